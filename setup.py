@@ -19,6 +19,11 @@ setup(
             'wfchef-create-recipe=wfchef.chef:main',
             'wfchef-find-microstructures=wfchef.find_microstructures:main',
             'wfchef-duplicate=wfchef.duplicate:main',
+            'wfchef-find-microstructures-banded=wfchef.banded:main',
+            'wfchef-serve=wfchef.serve:main',
+            'wfchef-find-microstructures-batch=wfchef.batch:main',
+            'wfchef-store=wfchef.store:main',
+            'wfchef-distributed=wfchef.distributed:main',
         ],
     },
     url="https://github.com/tainagdcoleman/wfchef",
@@ -0,0 +1,393 @@
+import pathlib
+import json
+import sqlite3
+import argparse
+import tempfile
+import networkx as nx
+from typing import IO, Any, Dict, List, Set, FrozenSet, Iterator, Optional, Union, Iterable, Tuple
+from .utils import job_type_id, type_hash, combine_hashes
+from .find_microstructures import find_microstructures
+
+this_dir = pathlib.Path(__file__).resolve().parent
+
+Microstructures = Dict[str, Set[FrozenSet[str]]]
+
+class _JSONReader:
+    """Reads a JSON document from fp a value at a time, so only the value being read is in memory"""
+    def __init__(self, fp: IO[str], chunk_size: int = 2**20) -> None:
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def fill(self) -> bool:
+        data = self.fp.read(self.chunk_size)
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        self.eof = not data
+        return bool(data)
+
+    def peek(self) -> str:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                raise ValueError("Unexpected end of JSON document")
+
+    def expect(self, char: str) -> None:
+        if self.peek() != char:
+            raise ValueError(f"Expected {char!r} at {self.buf[self.pos:self.pos + 20]!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def keys(self) -> Iterator[str]:
+        """Yields the keys of an object, the caller reads each key's value before the next key"""
+        self.expect("{")
+        first = True
+        while self.peek() != "}":
+            if not first:
+                self.expect(",")
+            first = False
+            key = self.value()
+            self.expect(":")
+            yield key
+        self.pos += 1
+
+    def items(self) -> Iterator[None]:
+        """Yields once per element of an array, the caller reads each element"""
+        self.expect("[")
+        first = True
+        while self.peek() != "]":
+            if not first:
+                self.expect(",")
+            first = False
+            yield
+        self.pos += 1
+
+def iter_trace(path: Union[str, pathlib.Path]) -> Iterator[Tuple[str, Any]]:
+    """Yields ("name", trace name) and ("job", job) for a workflowhub trace, in file order, without loading all of it"""
+    with pathlib.Path(path).open() as fp:
+        reader = _JSONReader(fp)
+        for key in reader.keys():
+            if key == "name":
+                yield "name", reader.value()
+            elif key == "workflow":
+                for workflow_key in reader.keys():
+                    if workflow_key == "jobs":
+                        for _ in reader.items():
+                            yield "job", reader.value()
+                    else:
+                        reader.value()
+            else:
+                reader.value()
+
+def spill_trace(path: Union[str, pathlib.Path], db_path: Union[str, pathlib.Path]) -> sqlite3.Connection:
+    """Writes the nodes and edges of a workflowhub trace to a sqlite database instead of a nx.DiGraph.
+
+    The trace is read one job at a time (see iter_trace).
+    """
+    path = pathlib.Path(path)
+    db_path = pathlib.Path(db_path)
+    if db_path.exists():
+        db_path.unlink()
+
+    conn = sqlite3.connect(str(db_path))
+    conn.executescript("""
+        CREATE TABLE nodes (
+            name TEXT PRIMARY KEY, type TEXT, id TEXT, level INTEGER,
+            top_down_type_hash TEXT, bottom_up_type_hash TEXT, type_hash TEXT, seq INTEGER
+        );
+        CREATE TABLE edges (src TEXT, dst TEXT);
+    """)
+
+    conn.execute("INSERT INTO nodes (name, type, id) VALUES ('SRC', 'SRC', 'SRC')")
+    conn.execute("INSERT INTO nodes (name, type, id) VALUES ('DST', 'DST', 'DST')")
+    trace_name, seq = "", 0
+    for kind, value in iter_trace(path):
+        if kind == "name":
+            trace_name = value
+            continue
+        conn.execute("INSERT INTO nodes (name, seq) VALUES (?, ?)", (value["name"], seq))
+        conn.executemany("INSERT INTO edges (src, dst) VALUES (?, ?)", [(parent, value["name"]) for parent in value["parents"]])
+        seq += 1
+
+    # types and ids depend on the name of the trace, which may come after the jobs
+    conn.create_function("job_type", 2, lambda name, seq: job_type_id(trace_name, name, seq)[0])
+    conn.create_function("job_id", 2, lambda name, seq: job_type_id(trace_name, name, seq)[1])
+    conn.execute("UPDATE nodes SET type = job_type(name, seq), id = job_id(name, seq) WHERE seq IS NOT NULL")
+
+    conn.executescript("""
+        CREATE INDEX edges_src ON edges (src);
+        CREATE INDEX edges_dst ON edges (dst);
+        INSERT INTO edges (src, dst)
+            SELECT 'SRC', name FROM nodes
+            WHERE name NOT IN ('SRC', 'DST') AND name NOT IN (SELECT dst FROM edges);
+        INSERT INTO edges (src, dst)
+            SELECT name, 'DST' FROM nodes
+            WHERE name NOT IN ('SRC', 'DST') AND name NOT IN (SELECT src FROM edges);
+    """)
+    conn.commit()
+    return conn
+
+def annotate_spilled(conn: sqlite3.Connection) -> int:
+    """Same as utils.annotate, but for a trace spilled with spill_trace. Returns the maximum level."""
+    # TOP DOWN
+    remaining = dict(conn.execute("SELECT dst, COUNT(*) FROM edges GROUP BY dst"))
+    queue = [name for name, in conn.execute("SELECT name FROM nodes") if name not in remaining]
+    max_level = 0
+    while queue:
+        cur = queue.pop()
+        parents = conn.execute(
+            "SELECT n.level, n.top_down_type_hash FROM edges e JOIN nodes n ON n.name = e.src WHERE e.dst = ?", (cur,)
+        ).fetchall()
+        _type, = conn.execute("SELECT type FROM nodes WHERE name = ?", (cur,)).fetchone()
+        level = 1 + max([parent_level for parent_level, _ in parents], default=0)
+        max_level = max(max_level, level)
+        conn.execute(
+            "UPDATE nodes SET level = ?, top_down_type_hash = ? WHERE name = ?",
+            (level, type_hash(_type, [th for _, th in parents]), cur)
+        )
+        for child, in conn.execute("SELECT dst FROM edges WHERE src = ?", (cur,)).fetchall():
+            remaining[child] -= 1
+            if remaining[child] <= 0:
+                queue.append(child)
+
+    # REVERSE
+    remaining = dict(conn.execute("SELECT src, COUNT(*) FROM edges GROUP BY src"))
+    queue = [name for name, in conn.execute("SELECT name FROM nodes") if name not in remaining]
+    while queue:
+        cur = queue.pop()
+        children_ths = [
+            th for th, in conn.execute(
+                "SELECT n.bottom_up_type_hash FROM edges e JOIN nodes n ON n.name = e.dst WHERE e.src = ?", (cur,)
+            )
+        ]
+        _type, top_down = conn.execute("SELECT type, top_down_type_hash FROM nodes WHERE name = ?", (cur,)).fetchone()
+        bottom_up = type_hash(_type, children_ths)
+        conn.execute(
+            "UPDATE nodes SET bottom_up_type_hash = ?, type_hash = ? WHERE name = ?",
+            (bottom_up, combine_hashes(top_down, bottom_up), cur)
+        )
+        for parent, in conn.execute("SELECT src FROM edges WHERE dst = ?", (cur,)).fetchall():
+            remaining[parent] -= 1
+            if remaining[parent] <= 0:
+                queue.append(parent)
+
+    conn.execute("CREATE INDEX nodes_level ON nodes (level)")
+    conn.commit()
+    return max_level
+
+def load_band(conn: sqlite3.Connection, start: int, stop: int) -> nx.DiGraph:
+    """Loads the nodes with start <= level < stop (and DST) with the edges among them"""
+    graph = nx.DiGraph()
+    rows = conn.execute(
+        "SELECT name, type, id, level, top_down_type_hash, bottom_up_type_hash, type_hash FROM nodes "
+        "WHERE (level >= ? AND level < ?) OR name = 'DST'",
+        (start, stop)
+    )
+    for name, _type, _id, level, top_down, bottom_up, th in rows:
+        graph.add_node(
+            name, label=_id, type=_type, id=_id, level=level,
+            top_down_type_hash=top_down, bottom_up_type_hash=bottom_up, type_hash=th
+        )
+
+    edges = conn.execute(
+        "SELECT e.src, e.dst FROM edges e JOIN nodes n ON n.name = e.src WHERE n.level >= ? AND n.level < ?",
+        (start, stop)
+    )
+    graph.add_edges_from((src, dst) for src, dst in edges if dst in graph)
+    return graph
+
+def count_truncated(conn: sqlite3.Connection, graph: nx.DiGraph, parents: Iterable[str], microstructures: Microstructures) -> int:
+    """Number of instances and sibling groups the band cut off.
+
+    An instance is cut off if one of its nodes has a parent or child that was not loaded and that is not shared
+    with another instance of the microstructure (which would only end the instance). A sibling group is cut off
+    if one of the siblings was not loaded.
+    """
+    relatives: Dict[str, Set[str]] = {}
+    def get_relatives(node: str) -> Set[str]:
+        if node not in relatives:
+            relatives[node] = {
+                relative for relative, in conn.execute(
+                    "SELECT src FROM edges WHERE dst = ? UNION SELECT dst FROM edges WHERE src = ?", (node, node)
+                )
+            }
+        return relatives[node]
+
+    truncated = 0
+    for instances in microstructures.values():
+        ms_nodes = set().union(*instances)
+        for instance in instances:
+            missing = {relative for node in instance if node != "DST" for relative in get_relatives(node) if relative not in graph}
+            if any(get_relatives(relative).isdisjoint(ms_nodes - instance) for relative in missing):
+                truncated += 1
+
+    for parent in parents:
+        siblings: Dict[str, List[str]] = {}
+        for child, th in conn.execute("SELECT n.name, n.type_hash FROM edges e JOIN nodes n ON n.name = e.dst WHERE e.src = ?", (parent,)):
+            siblings.setdefault(th, []).append(child)
+        truncated += sum(
+            1 for children in siblings.values()
+            if len(children) > 1 and any(child not in graph for child in children)
+        )
+    return truncated
+
+def iter_bands(max_level: int, band_size: int, overlap: int) -> Iterable[Tuple[int, int, int, int]]:
+    """Yields (start, stop, loaded_start, loaded_stop) for every band of levels.
+
+    Sibling groups are only mined in the band which owns the level of their parent ([start, stop)),
+    so every microstructure instance is found by exactly one band.
+    """
+    for start in range(1, max_level + 1, band_size):
+        stop = start + band_size
+        yield start, stop, max(1, start - overlap), min(max_level + 1, stop + overlap)
+
+def find_microstructures_banded(path: Union[str, pathlib.Path],
+                                workdir: Union[str, pathlib.Path],
+                                band_size: int = 50,
+                                overlap: int = 4,
+                                verbose: bool = False) -> Tuple[Microstructures, int, int]:
+    """Finds the microstructures of a trace one band of levels at a time.
+
+    Every band is loaded from a sqlite spill of the trace with `overlap` extra levels above and below,
+    so overlap should be at least the depth (in levels) of the deepest microstructure.
+    Per band results are written to workdir and merged at the end.
+
+    Returns the merged microstructures and the order and size of the full graph.
+    """
+    workdir = pathlib.Path(workdir)
+    workdir.mkdir(exist_ok=True, parents=True)
+    if verbose:
+        print(f"Spilling {path} to {workdir}")
+    conn = spill_trace(path, workdir.joinpath("graph.sqlite"))
+    max_level = annotate_spilled(conn)
+    order, = conn.execute("SELECT COUNT(*) FROM nodes").fetchone()
+    size, = conn.execute("SELECT COUNT(*) FROM edges").fetchone()
+
+    band_paths = []
+    truncated = 0
+    for i, (start, stop, loaded_start, loaded_stop) in enumerate(iter_bands(max_level, band_size, overlap)):
+        if verbose:
+            print(f"Mining levels {start}-{stop - 1} (loaded {loaded_start}-{loaded_stop - 1} of {max_level})")
+        graph = load_band(conn, loaded_start, loaded_stop)
+        parents = [node for node in graph.nodes if start <= graph.nodes[node]["level"] < stop]
+        microstructures = find_microstructures(graph, parents=parents)
+
+        truncated += count_truncated(conn, graph, parents, microstructures)
+
+        band_path = workdir.joinpath(f"band_{i}.json")
+        band_path.write_text(json.dumps({
+            ms_hash: [sorted(instance) for instance in instances]
+            for ms_hash, instances in microstructures.items()
+        }))
+        band_paths.append(band_path)
+        del graph, microstructures
+
+    conn.close()
+    if truncated:
+        print(f"{truncated} microstructure instances or sibling groups were cut off by their band, consider increasing the overlap")
+
+    merged: Microstructures = {}
+    for band_path in band_paths:
+        for ms_hash, instances in json.loads(band_path.read_text()).items():
+            merged.setdefault(ms_hash, set())
+            merged[ms_hash].update(map(frozenset, instances))
+
+    return merged, order, size
+
+def save_microstructures_banded(path: pathlib.Path,
+                                savedir: pathlib.Path,
+                                workdir: Optional[pathlib.Path] = None,
+                                band_size: int = 50,
+                                overlap: int = 4,
+                                verbose: bool = False) -> None:
+    """Mines a trace too large for save_microstructures and adds its frequencies to savedir's summary.
+
+    The trace is not pickled as a base graph, it only contributes frequencies for interpolation.
+    """
+    path = pathlib.Path(path)
+    if workdir is None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            return save_microstructures_banded(path, savedir, pathlib.Path(tmpdir), band_size, overlap, verbose)
+
+    microstructures, order, size = find_microstructures_banded(path, workdir, band_size, overlap, verbose)
+
+    summary_path = savedir.joinpath("summary.json")
+    if summary_path.exists():
+        summary = json.loads(summary_path.read_text())
+    else:
+        summary = {"frequencies": {}, "base_graphs": {}}
+    summary.setdefault("banded_graphs", {})
+
+    # remove the points of a previous run on the same trace (only those, other graphs may have the same order)
+    previous = summary["banded_graphs"].get(path.stem)
+    if previous is not None:
+        for ms_name, freq in previous.get("frequencies", {}).items():
+            freqs = summary["frequencies"].get(ms_name, [])
+            if [previous["order"], freq] in freqs:
+                freqs.remove([previous["order"], freq])
+            if ms_name in summary["frequencies"] and not freqs:
+                del summary["frequencies"][ms_name]
+    contributed = {}
+    summary["banded_graphs"][path.stem] = {"size": size, "order": order, "frequencies": contributed}
+
+    g_savedir = savedir.joinpath(path.stem)
+    g_savedir.mkdir(exist_ok=True, parents=True)
+    mdatas = {}
+    for ms_hash, instances in microstructures.items():
+        ms_name = f"microstructure_{ms_hash}"
+        summary["frequencies"].setdefault(ms_name, [])
+        summary["frequencies"][ms_name].append([order, len(instances)])
+        contributed[ms_name] = len(instances)
+        mdatas[ms_name] = {
+            "name": ms_name,
+            "nodes": list(map(list, instances)),
+            "frequency": len(instances),
+            "base_graph_path": None,
+        }
+
+    g_savedir.joinpath("microstructures.json").write_text(json.dumps(mdatas, indent=2))
+    summary_path.parent.mkdir(exist_ok=True, parents=True)
+    summary_path.write_text(json.dumps(summary, indent=2))
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', help="workflow JSON too large to mine in memory", type=pathlib.Path)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print logs")
+    parser.add_argument("-n", "--name", required=True, help="name for workflow")
+    parser.add_argument("-b", "--band-size", type=int, default=50, help="number of levels mined per band")
+    parser.add_argument("-o", "--overlap", type=int, default=4, help="extra levels loaded above and below each band, at least the depth of the deepest microstructure")
+    parser.add_argument("-w", "--workdir", type=pathlib.Path, default=None, help="directory to spill to. Default is a temporary directory.")
+
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    outpath = this_dir.joinpath("microstructures", args.name)
+
+    save_microstructures_banded(
+        args.path, outpath, args.workdir, band_size=args.band_size,
+        overlap=args.overlap, verbose=args.verbose
+    )
+
+if __name__ == "__main__":
+    main()
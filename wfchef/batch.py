@@ -0,0 +1,174 @@
+import pathlib
+import json
+import time
+import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Tuple
+from .utils import create_graph, annotate
+from .find_microstructures import save_graph_microstructures
+from .store import write_index
+
+this_dir = pathlib.Path(__file__).resolve().parent
+
+def read_manifest(manifest_path: pathlib.Path) -> Dict[str, pathlib.Path]:
+    """Reads a JSON manifest mapping application names to directories of workflow JSONs.
+
+    Relative paths are relative to the manifest.
+    """
+    manifest_path = pathlib.Path(manifest_path)
+    manifest = json.loads(manifest_path.read_text())
+    return {
+        name: manifest_path.parent.joinpath(path).resolve()
+        for name, path in manifest.items()
+    }
+
+def get_order(path: pathlib.Path) -> int:
+    """Order of the graph create_graph would build for path (jobs plus SRC and DST)"""
+    content = json.loads(path.read_text())
+    return len(content['workflow']['jobs']) + 2
+
+def mine_instance(path: pathlib.Path,
+                  savedir: pathlib.Path,
+                  img_type: Optional[str] = None,
+                  highlight_all_instances: bool = False) -> Dict:
+    start = time.time()
+    graph = create_graph(path)
+    annotate(graph)
+    graph.graph["name"] = path.stem
+    index = save_graph_microstructures(
+        graph, savedir, img_type=img_type, highlight_all_instances=highlight_all_instances
+    )
+    return {
+        "name": graph.name,
+        "size": graph.size(),
+        "order": graph.order(),
+        "index": index,
+        "seconds": time.time() - start,
+        "pid": os.getpid()
+    }
+
+def write_summary(savedir: pathlib.Path, results: List[Dict]) -> None:
+    """Writes the same summary.json and index.json as save_microstructures from the results of mine_instance"""
+    summary = {
+        "frequencies": {},
+        "base_graphs": {}
+    }
+    for result in sorted(results, key=lambda result: result["order"]):
+        summary["base_graphs"][result["name"]] = {
+            "size": result["size"],
+            "order": result["order"]
+        }
+        for ms_name, entry in result["index"]["microstructures"].items():
+            summary["frequencies"].setdefault(ms_name, [])
+            summary["frequencies"][ms_name].append((result["order"], entry["frequency"]))
+
+    savedir.mkdir(exist_ok=True, parents=True)
+    savedir.joinpath("summary").with_suffix(".json").write_text(json.dumps(summary, indent=2))
+    write_index(savedir, {result["name"]: result["index"] for result in results})
+
+def save_microstructures_batch(workflows: Dict[str, pathlib.Path],
+                               outdir: pathlib.Path,
+                               workers: Optional[int] = None,
+                               verbose: bool = False,
+                               img_type: Optional[str] = None,
+                               cutoff: int = 4000,
+                               highlight_all_instances: bool = False) -> Dict:
+    """Mines the instances of several applications on a single process pool.
+
+    Instances are submitted largest first (longest processing time first) to keep the makespan short,
+    and each application's summary is written as soon as its last instance is done.
+
+    Returns a timing report with one entry per instance and one per application.
+    """
+    start = time.time()
+    instances: List[Tuple[int, str, pathlib.Path]] = []
+    for name, workflow_path in workflows.items():
+        paths = list(workflow_path.glob("*.json"))
+        if not paths:
+            raise ValueError(f"No graphs found in {workflow_path}")
+        for path in paths:
+            order = get_order(path)
+            if order > cutoff:
+                print(f"Skipping {name}/{path.stem}: it has more than {cutoff} tasks")
+                continue
+            instances.append((order, name, path))
+    instances.sort(key=lambda instance: instance[0], reverse=True)
+
+    remaining = {name: 0 for name in workflows}
+    for _, name, _ in instances:
+        remaining[name] += 1
+
+    results: Dict[str, List[Dict]] = {name: [] for name in workflows}
+    report = {"instances": [], "applications": {}}
+    for name in workflows:
+        if remaining[name] <= 0:
+            write_summary(outdir.joinpath(name), [])
+            report["applications"][name] = {"instances": 0, "cpu_seconds": 0, "finished": 0}
+    with ProcessPoolExecutor(workers) as pool:
+        futures = {
+            pool.submit(mine_instance, path, outdir.joinpath(name), img_type, highlight_all_instances): name
+            for _, name, path in instances
+        }
+        for future in as_completed(futures):
+            name = futures[future]
+            result = future.result()
+            results[name].append(result)
+            report["instances"].append({
+                "application": name,
+                "name": result["name"],
+                "order": result["order"],
+                "seconds": result["seconds"],
+                "pid": result["pid"]
+            })
+            if verbose:
+                print(f"{name}/{result['name']} ({result['order']} tasks): {result['seconds']:.2f}s")
+
+            remaining[name] -= 1
+            if remaining[name] <= 0:
+                write_summary(outdir.joinpath(name), results[name])
+                report["applications"][name] = {
+                    "instances": len(results[name]),
+                    "cpu_seconds": sum(result["seconds"] for result in results[name]),
+                    "finished": time.time() - start
+                }
+                if verbose:
+                    print(f"Wrote summary for {name}")
+
+    report["makespan"] = time.time() - start
+    report["cpu_seconds"] = sum(instance["seconds"] for instance in report["instances"])
+    return report
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('manifest', help="JSON file mapping workflow names to directories of workflow JSONs", type=pathlib.Path)
+    parser.add_argument("-v", "--verbose", action="store_true", help="print logs")
+    parser.add_argument("-o", "--outdir", type=pathlib.Path, default=this_dir.joinpath("microstructures"), help="directory to save the microstructures of each workflow to")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes. Default is the number of cpus.")
+    parser.add_argument("-d", "--draw", default=None, help="output types for images. anything that matplotlib supports (png, jpg, pdf, etc.). Default is None.")
+    parser.add_argument("-c", "--cutoff", type=int, default=4000, help="max order of workflow")
+    parser.add_argument("-l", "--highlight-all-instances", action="store_true", help="if set, highlights all instances of the microstructure")
+    parser.add_argument("-r", "--report", type=pathlib.Path, default=None, help="path to save the timing report to. Default is OUTDIR/batch_report.json")
+
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    report = save_microstructures_batch(
+        read_manifest(args.manifest), args.outdir, workers=args.workers, verbose=args.verbose,
+        img_type=args.draw, cutoff=args.cutoff, highlight_all_instances=args.highlight_all_instances
+    )
+
+    report_path = args.report or args.outdir.joinpath("batch_report.json")
+    report_path.parent.mkdir(exist_ok=True, parents=True)
+    report_path.write_text(json.dumps(report, indent=2))
+
+    print(f"{'application':20} {'instances':>10} {'cpu (s)':>10} {'done at (s)':>12}")
+    for name, app in sorted(report["applications"].items(), key=lambda x: x[1]["finished"]):
+        print(f"{name:20} {app['instances']:>10} {app['cpu_seconds']:>10.2f} {app['finished']:>12.2f}")
+    print(f"Makespan: {report['makespan']:.2f}s, total cpu: {report['cpu_seconds']:.2f}s. Report saved to {report_path}")
+
+if __name__ == "__main__":
+    main()
@@ -2,76 +2,140 @@
 import pathlib
 import json
 from workflowhub.generator.workflow.abstract_recipe import WorkflowRecipe, Workflow
-from typing import Optional, Union, Dict, Any
+from typing import Optional, Union, Dict, Any, Tuple, Callable
 import argparse
 import shutil
+import os
 from stringcase import camelcase, snakecase
 import pickle
-from wfchef.duplicate import duplicate, NoMicrostructuresError
+from wfchef.duplicate import grow, load_base, growth_fingerprint, NoMicrostructuresError
+from wfchef.utils import seed_random
+from wfchef.store import base_fingerprint, cell_key
+from wfchef.estimate import CountModel, estimate_rmse, histogram_rmse, type_hash_counts
 import pandas as pd
 import networkx as nx
-import math
 import subprocess
 import numpy as np
 
+try:
+    import fcntl
+except ImportError: # not available on windows
+    fcntl = None
+
 this_dir = pathlib.Path(__file__).resolve().parent
 skeleton_path = this_dir.joinpath("skeletons")
+FICLONE = 0x40049409 # linux ioctl to reflink a file
 
 def compare_rmse(synth_graph: nx.DiGraph, real_graph: nx.DiGraph):
-    synthetic = {}
-    real = {}
-    
-    for node in synth_graph.nodes:
-        _type = synth_graph.nodes[node]['type_hash']
-        synthetic.setdefault(_type, 0)
-        synthetic[_type] +=1 
-
-    for node in real_graph.nodes:
-        _type = real_graph.nodes[node]['type_hash']
-        real.setdefault(_type, 0)
-        real[_type] +=1 
-    
-    _types = ({*synthetic.keys(), *real.keys()})
-
-    mse = math.sqrt(sum([
-        (real.get(_type, 0) - synthetic.get(_type, 0))**2
-        for _type in _types
-    ]) / len(_types))
-    return mse / real_graph.order()
+    return histogram_rmse(type_hash_counts(synth_graph), type_hash_counts(real_graph), real_graph.order())
 
 def find_err(workflow: Union[str, pathlib.Path], 
              err_savepath: Optional[Union[str, pathlib.Path]] = None,
              always_update: bool = False,
-             runs: int = 1) -> None:
+             runs: int = 1,
+             screen: Optional[int] = None,
+             analytic: bool = False,
+             seed: Optional[int] = None,
+             cache_path: Optional[Union[str, pathlib.Path]] = None) -> None:
+    """Computes the RMSE of synthetic graphs grown from every base graph against every larger real graph.
+
+    If screen is set, the errors are first estimated from type hash counts only (see wfchef.estimate)
+    and only the screen bases with the lowest estimates for each real graph are actually generated.
+    The other cells keep their estimates.
+
+    If seed is set, every run is seeded from seed, the names of its graphs and its index. If cache_path is set,
+    each cell is stored there under a fingerprint of its inputs (base graph, microstructure instances and
+    the probabilities growth uses at the real graph's size, real graph type hashes, runs, seed) and only
+    cells whose inputs changed are recomputed.
+    """
     summary = json.loads(workflow.joinpath("summary.json").read_text())
     sorted_graphs = sorted([name for name, _ in summary["base_graphs"].items()], key=lambda name: summary["base_graphs"][name]["order"])
     
     if err_savepath:
         err_savepath = pathlib.Path(err_savepath)
         err_savepath.parent.mkdir(exist_ok=True, parents=True)
-        
+
+    cache, used = {}, {}
+    if cache_path:
+        cache_path = pathlib.Path(cache_path)
+        if cache_path.exists():
+            cache = json.loads(cache_path.read_text())
+
+    bases, base_fps = {}, {}
+    def get_base(base: str) -> Tuple[nx.DiGraph, Dict]:
+        if base not in bases:
+            bases[base] = load_base(workflow.joinpath(base))
+            base_fps[base] = base_fingerprint(*bases[base])
+        return bases[base]
+
+    def get_growth_fp(base: str, num_nodes: int) -> str:
+        return growth_fingerprint(
+            base_fps[base], *get_base(base), summary, num_nodes,
+            interpolate_limit=summary["base_graphs"][base]["order"]
+        )
+
+    def memoized(key: str, compute: Callable[[], float]) -> Optional[float]:
+        if key not in cache:
+            try:
+                cache[key] = compute()
+            except NoMicrostructuresError:
+                print(f"No Microstructures Error")
+                cache[key] = None
+        used[key] = cache[key]
+        return cache[key]
+
     labels = [graph for graph in sorted_graphs]
     rows = [[None for _ in range(len(sorted_graphs))] for _ in range(len(sorted_graphs))]
     df = None 
-    for i, path in enumerate(sorted_graphs[1:], start=1):
-        path = workflow.joinpath(path)
+    for i, name in enumerate(sorted_graphs[1:], start=1):
+        path = workflow.joinpath(name)
         wf_real = pickle.loads(path.joinpath("base_graph.pickle").read_bytes())
+        real = type_hash_counts(wf_real)
+
+        candidates = set(sorted_graphs[:i+1])
+        if screen is not None:
+            estimates = {}
+            for j, base in enumerate(sorted_graphs[:i+1]):
+                get_base(base)
+                def estimate() -> float:
+                    if seed is not None:
+                        seed_random(seed, base, name)
+                    model = CountModel(
+                        *bases[base], summary, 
+                        num_nodes=wf_real.order(),
+                        interpolate_limit=summary["base_graphs"][base]["order"]
+                    )
+                    return estimate_rmse(model, real, wf_real.order(), runs=runs, analytic=analytic)
+
+                key = cell_key("estimate", get_growth_fp(base, wf_real.order()), real, runs, seed, analytic)
+                rows[j][i] = memoized(key, estimate)
+                if rows[j][i] is not None:
+                    estimates[base] = rows[j][i]
+            candidates = set(sorted(estimates, key=estimates.get)[:screen])
 
         for j, base in enumerate(sorted_graphs[:i+1]):             
-            try:
+            if base not in candidates:
+                continue
+            get_base(base)
+            def generate() -> float:
+                graph, microstructures = bases[base]
                 dists = []
-                for _ in range(runs):
-                    wf_synth = duplicate(
-                        path=workflow,
-                        base=base,
+                for run in range(runs):
+                    if seed is not None:
+                        seed_random(seed, base, name, run)
+                    wf_synth = grow(
+                        graph.copy(), microstructures, summary,
                         num_nodes=wf_real.order(),
                         interpolate_limit=summary["base_graphs"][base]["order"]
                     )
                     dists.append(compare_rmse(wf_synth, wf_real))
-                rows[j][i] = np.median(dists)
-            except NoMicrostructuresError:
-                print(f"No Microstructures Error")
-                continue  
+                return np.median(dists)
+
+            key = cell_key("generate", get_growth_fp(base, wf_real.order()), real, runs, seed)
+            value = memoized(key, generate)
+            if value is None:
+                continue
+            rows[j][i] = value
 
             if err_savepath is not None and always_update:
                 df = pd.DataFrame(rows, columns=labels, index=labels)
@@ -79,6 +143,10 @@ def find_err(workflow: Union[str, pathlib.Path],
                 df = df.dropna(axis=0, how='all')
                 err_savepath.write_text(df.to_csv())
 
+    if cache_path:
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        cache_path.write_text(json.dumps(used, indent=2))
+
     df = pd.DataFrame(rows, columns=labels, index=labels)
     df = df.dropna(axis=1, how='all')
     df = df.dropna(axis=0, how='all')
@@ -86,10 +154,42 @@ def find_err(workflow: Union[str, pathlib.Path],
         err_savepath.write_text(df.to_csv())
     return df
 
-def create_recipe(path: Union[str, pathlib.Path], dst: Union[str, pathlib.Path], runs: int = 1) -> WorkflowRecipe:
+def link_or_copy(src: pathlib.Path, dst: pathlib.Path) -> None:
+    """Reflinks, hardlinks or (if neither is supported) copies src to dst.
+
+    Hardlinked files share their content with src, so rewriting src in place also changes dst.
+    """
+    dst.parent.mkdir(exist_ok=True, parents=True)
+    if dst.exists():
+        if dst.samefile(src):
+            return
+        dst.unlink()
+
+    if fcntl is not None:
+        try:
+            with src.open("rb") as src_fp, dst.open("wb") as dst_fp:
+                fcntl.ioctl(dst_fp.fileno(), FICLONE, src_fp.fileno())
+            return
+        except OSError:
+            dst.unlink(missing_ok=True)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(src, dst)
+
+def create_recipe(path: Union[str, pathlib.Path], 
+                  dst: Union[str, pathlib.Path], 
+                  runs: int = 1,
+                  screen: Optional[int] = None,
+                  analytic: bool = False,
+                  seed: Optional[int] = None) -> WorkflowRecipe:
     err_savepath = path.joinpath("metric", "err.csv")
     err_savepath.parent.mkdir(exist_ok=True, parents=True)
-    df = find_err(path, runs=runs)
+    df = find_err(
+        path, runs=runs, screen=screen, analytic=analytic, seed=seed,
+        cache_path=path.joinpath("metric", "err_cache.json")
+    )
 
     err_savepath.write_text(df.to_csv())
     
@@ -98,18 +198,13 @@ def create_recipe(path: Union[str, pathlib.Path], dst: Union[str, pathlib.Path],
     dst = pathlib.Path(dst, snakecase(wf_name)).resolve()
     dst.mkdir(exist_ok=True, parents=True)
 
-    dst_metric_path = dst.joinpath("metric", "err.csv")
-    dst_metric_path.parent.mkdir(parents=True, exist_ok=True)
-    shutil.copy(path.joinpath("metric", "err.csv"), dst_metric_path)
-    
-    summary_path = dst.joinpath("microstructures", "summary.json")
-    summary_path.parent.mkdir(exist_ok=True, parents=True)
-    shutil.copy(path.joinpath("summary.json"), summary_path)
+    link_or_copy(path.joinpath("metric", "err.csv"), dst.joinpath("metric", "err.csv"))
+    link_or_copy(path.joinpath("summary.json"), dst.joinpath("microstructures", "summary.json"))
+    if path.joinpath("index.json").exists():
+        link_or_copy(path.joinpath("index.json"), dst.joinpath("microstructures", "index.json"))
     for filename in ["base_graph.pickle", "microstructures.json"]:
         for p in path.glob(f"*/{filename}"):
-            dst_path = dst.joinpath("microstructures", p.parent.stem, filename)
-            dst_path.parent.mkdir(exist_ok=True, parents=True)
-            shutil.copy(p, dst_path)
+            link_or_copy(p, dst.joinpath("microstructures", p.parent.stem, filename))
 
     # Recipe 
     with skeleton_path.joinpath("recipe.py").open() as fp:
@@ -156,6 +251,21 @@ def get_parser() -> argparse.ArgumentParser:
         default=1, type=int,
         help="number of runs to compute mean RMSE"
     )
+    parser.add_argument(
+        "-s", "--screen",
+        default=None, type=int,
+        help="if set, estimates the RMSE of every base from type hash counts and only generates graphs for the best SCREEN bases"
+    )
+    parser.add_argument(
+        "-a", "--analytic",
+        action="store_true",
+        help="if set, screening uses the analytic expected RMSE instead of sampling type hash counts"
+    )
+    parser.add_argument(
+        "--seed",
+        default=None, type=int,
+        help="if set, seeds the generation of every cell of the error matrix"
+    )
     return parser
 
 def main():
@@ -163,7 +273,7 @@ def main():
     args = parser.parse_args()
     src = this_dir.joinpath("microstructures", args.workflow)
     dst = src.joinpath("recipe")
-    create_recipe(src, dst, runs=args.runs)
+    create_recipe(src, dst, runs=args.runs, screen=args.screen, analytic=args.analytic, seed=args.seed)
 
     if args.install:
         proc = subprocess.Popen(["pip", "install", str(dst)])
@@ -0,0 +1,53 @@
+import json
+import socket
+import pathlib
+from typing import Dict, Optional, Union
+
+class Client:
+    """Thin client for wfchef-serve. Only depends on the standard library.
+
+    :param socket_path: unix socket the server listens on. If not set, connects to host and port.
+    :type socket_path: Optional[Union[str, pathlib.Path]]
+    """
+    def __init__(self,
+                 socket_path: Optional[Union[str, pathlib.Path]] = None,
+                 host: str = "127.0.0.1",
+                 port: int = 8765) -> None:
+        if socket_path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(str(socket_path))
+        else:
+            self.sock = socket.create_connection((host, port))
+        self.file = self.sock.makefile("rb")
+
+    def request(self, request: Dict) -> Dict:
+        self.sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        return json.loads(self.file.readline())
+
+    def generate(self,
+                 workflow: str,
+                 num_tasks: int,
+                 seed: Optional[int] = None,
+                 format: str = "node_link",
+                 base: Optional[str] = None) -> Dict:
+        """Requests a synthetic graph of workflow with num_tasks nodes
+
+        :return: the server's response, with the graph under "graph" and the base and seed used to generate it.
+        :rtype: Dict
+        """
+        response = self.request({
+            "workflow": workflow, "num_tasks": num_tasks, "seed": seed, "format": format, "base": base
+        })
+        if not response["ok"]:
+            raise RuntimeError(response["error"])
+        return response
+
+    def close(self) -> None:
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self) -> 'Client':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
@@ -0,0 +1,274 @@
+import pathlib
+import json
+import time
+import sqlite3
+import socket
+import os
+import pickle
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, Optional, Tuple, Union
+from .duplicate import load_summary, load_base, grow, growth_fingerprint, NoMicrostructuresError
+from .estimate import type_hash_counts, histogram_rmse
+from .store import base_fingerprint, cell_key
+from .utils import seed_random
+
+this_dir = pathlib.Path(__file__).resolve().parent
+
+def connect(db_path: Union[str, pathlib.Path]) -> sqlite3.Connection:
+    # no WAL: the database may live on a shared (network) filesystem
+    conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    return conn
+
+def submit(workflow: pathlib.Path, db_path: pathlib.Path, runs: int = 1, seed: Optional[int] = None) -> int:
+    """Creates a queue with one task per (base, reference, run) of the error matrix of workflow.
+
+    Returns the number of tasks.
+    """
+    workflow = pathlib.Path(workflow).resolve()
+    summary = load_summary(workflow)
+    sorted_graphs = sorted(summary["base_graphs"], key=lambda name: summary["base_graphs"][name]["order"])
+
+    db_path = pathlib.Path(db_path)
+    if db_path.exists():
+        db_path.unlink()
+    conn = connect(db_path)
+    conn.executescript("""
+        CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE tasks (
+            id INTEGER PRIMARY KEY, base TEXT, real TEXT, run INTEGER,
+            status TEXT DEFAULT 'pending', worker TEXT, leased_until REAL,
+            attempts INTEGER DEFAULT 0, result REAL, error TEXT
+        );
+        CREATE INDEX tasks_status ON tasks (status);
+    """)
+    conn.execute("BEGIN IMMEDIATE")
+    conn.executemany("INSERT INTO meta (key, value) VALUES (?, ?)", [
+        ("workflow", str(workflow)), ("runs", json.dumps(runs)), ("seed", json.dumps(seed))
+    ])
+    # largest references first, they take the longest
+    tasks = [
+        (base, real, run)
+        for i, real in reversed(list(enumerate(sorted_graphs[1:], start=1)))
+        for base in sorted_graphs[:i+1]
+        for run in range(runs)
+    ]
+    conn.executemany("INSERT INTO tasks (base, real, run) VALUES (?, ?, ?)", tasks)
+    conn.execute("COMMIT")
+    conn.close()
+    return len(tasks)
+
+def get_meta(conn: sqlite3.Connection) -> Dict:
+    return {key: value if key == "workflow" else json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+
+def count_remaining(conn: sqlite3.Connection, max_attempts: int) -> int:
+    """Number of tasks that can still finish: pending ones with attempts left, and running ones that are
+    still leased (whatever their attempt) or can be re-issued once their lease expires"""
+    remaining, = conn.execute(
+        "SELECT COUNT(*) FROM tasks "
+        "WHERE (status = 'pending' AND attempts < ?) OR (status = 'running' AND (leased_until >= ? OR attempts < ?))",
+        (max_attempts, time.time(), max_attempts)
+    ).fetchone()
+    return remaining
+
+def claim(conn: sqlite3.Connection, worker: str, lease: float, max_attempts: int) -> Optional[Tuple[int, str, str, int]]:
+    """Leases the next pending task, or a task whose lease expired (its worker failed or is too slow)"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        now = time.time()
+        row = conn.execute(
+            "SELECT id, base, real, run FROM tasks "
+            "WHERE (status = 'pending' OR (status = 'running' AND leased_until < ?)) AND attempts < ? "
+            "ORDER BY id LIMIT 1",
+            (now, max_attempts)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE tasks SET status = 'running', worker = ?, leased_until = ?, attempts = attempts + 1 WHERE id = ?",
+                (worker, now + lease, row[0])
+            )
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return row
+
+def work(db_path: pathlib.Path,
+         workflow: Optional[pathlib.Path] = None,
+         worker: Optional[str] = None,
+         lease: float = 600,
+         max_attempts: int = 3,
+         poll: float = 5,
+         verbose: bool = False) -> int:
+    """Computes tasks from the queue until none are left. Returns the number of tasks computed.
+
+    workflow overrides the path of the workflow recorded by submit (if it is mounted elsewhere on this host).
+    """
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    conn = connect(db_path)
+    meta = get_meta(conn)
+    workflow = pathlib.Path(workflow or meta["workflow"])
+    summary = load_summary(workflow)
+    bases, reals = {}, {}
+
+    done = 0
+    while True:
+        task = claim(conn, worker, lease, max_attempts)
+        if task is None:
+            if count_remaining(conn, max_attempts) == 0:
+                break
+            # other workers hold the last tasks, wait in case their leases expire
+            time.sleep(poll)
+            continue
+
+        task_id, base, real, run = task
+        if base not in bases:
+            bases[base] = load_base(workflow.joinpath(base))
+        if real not in reals:
+            wf_real = pickle.loads(workflow.joinpath(real, "base_graph.pickle").read_bytes())
+            reals[real] = (type_hash_counts(wf_real), wf_real.order())
+
+        real_counts, real_order = reals[real]
+        try:
+            if meta["seed"] is not None:
+                seed_random(meta["seed"], base, real, run)
+            graph, microstructures = bases[base]
+            wf_synth = grow(
+                graph.copy(), microstructures, summary,
+                num_nodes=real_order,
+                interpolate_limit=summary["base_graphs"][base]["order"]
+            )
+            result, error, status = histogram_rmse(type_hash_counts(wf_synth), real_counts, real_order), None, "done"
+        except NoMicrostructuresError:
+            result, error, status = None, "NoMicrostructuresError", "done"
+        except Exception as e:
+            result, error, status = None, f"{type(e).__name__}: {e}", "pending"
+
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE tasks SET status = ?, result = ?, error = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            (status, result, error, task_id, worker)
+        )
+        conn.execute("COMMIT")
+        done += 1
+        if verbose:
+            print(f"{worker}: {base} -> {real} run {run}: {error or result}")
+
+    conn.close()
+    return done
+
+def collect(db_path: pathlib.Path,
+            err_savepath: Optional[pathlib.Path] = None,
+            cache_path: Optional[pathlib.Path] = None,
+            wait: bool = True,
+            poll: float = 10,
+            max_attempts: int = 3) -> pd.DataFrame:
+    """Assembles the error matrix (the same as chef.find_err's) from the results of the tasks.
+
+    If wait is set, waits for all tasks to finish first. If cache_path is set, the cells are also added
+    to the err_cache.json of the workflow, so wfchef-create-recipe reuses them.
+    """
+    conn = connect(db_path)
+    meta = get_meta(conn)
+    while wait:
+        if count_remaining(conn, max_attempts) == 0:
+            break
+        time.sleep(poll)
+
+    workflow = pathlib.Path(meta["workflow"])
+    summary = load_summary(workflow)
+    sorted_graphs = sorted(summary["base_graphs"], key=lambda name: summary["base_graphs"][name]["order"])
+    index = {name: i for i, name in enumerate(sorted_graphs)}
+
+    cells: Dict[Tuple[str, str], list] = {}
+    failed = []
+    for base, real, run, status, result, error in conn.execute("SELECT base, real, run, status, result, error FROM tasks ORDER BY run"):
+        if status != "done":
+            failed.append((base, real, run, error))
+            continue
+        cells.setdefault((base, real), []).append(None if error else result)
+    conn.close()
+    for base, real, run, error in failed:
+        print(f"Task {base} -> {real} run {run} did not finish: {error}")
+
+    labels = [graph for graph in sorted_graphs]
+    rows = [[None for _ in range(len(sorted_graphs))] for _ in range(len(sorted_graphs))]
+    values = {}
+    for (base, real), results in cells.items():
+        if len(results) < meta["runs"]:
+            continue
+        values[(base, real)] = None if None in results else np.median(results)
+        if values[(base, real)] is not None:
+            rows[index[base]][index[real]] = values[(base, real)]
+
+    df = pd.DataFrame(rows, columns=labels, index=labels)
+    df = df.dropna(axis=1, how='all')
+    df = df.dropna(axis=0, how='all')
+    if err_savepath:
+        err_savepath = pathlib.Path(err_savepath)
+        err_savepath.parent.mkdir(exist_ok=True, parents=True)
+        err_savepath.write_text(df.to_csv())
+
+    if cache_path:
+        cache_path = pathlib.Path(cache_path)
+        cache = json.loads(cache_path.read_text()) if cache_path.exists() else {}
+        bases, reals = {}, {}
+        for (base, real), value in values.items():
+            if base not in bases:
+                graph, microstructures = load_base(workflow.joinpath(base))
+                bases[base] = (graph, microstructures, base_fingerprint(graph, microstructures))
+            if real not in reals:
+                wf_real = pickle.loads(workflow.joinpath(real, "base_graph.pickle").read_bytes())
+                reals[real] = (type_hash_counts(wf_real), wf_real.order())
+            graph, microstructures, base_fp = bases[base]
+            real_counts, real_order = reals[real]
+            growth_fp = growth_fingerprint(
+                base_fp, graph, microstructures, summary, real_order,
+                interpolate_limit=summary["base_graphs"][base]["order"]
+            )
+            cache[cell_key("generate", growth_fp, real_counts, meta["runs"], meta["seed"])] = value
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        cache_path.write_text(json.dumps(cache, indent=2))
+
+    return df
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["submit", "work", "collect"], help="submit: queue the tasks of a workflow's error matrix. work: compute tasks. collect: assemble err.csv.")
+    parser.add_argument("db", type=pathlib.Path, help="sqlite queue, on a filesystem shared by the coordinator and the workers")
+    parser.add_argument("-w", "--workflow", type=pathlib.Path, default=None, help="submit: workflow directory (or name in wfchef/microstructures). work: path of the workflow on this host, if it differs.")
+    parser.add_argument("-r", "--runs", default=1, type=int, help="number of runs to compute median RMSE")
+    parser.add_argument("-s", "--seed", default=None, type=int, help="if set, seeds every run")
+    parser.add_argument("--lease", default=600, type=float, help="seconds before a task is re-issued to another worker")
+    parser.add_argument("--max-attempts", default=3, type=int, help="number of times a task is issued before giving up")
+    parser.add_argument("-o", "--out", type=pathlib.Path, default=None, help="collect: path to save err.csv to. Default is WORKFLOW/metric/err.csv")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print logs")
+
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+
+    if args.command == "submit":
+        if args.workflow is None:
+            parser.error("submit requires --workflow")
+        workflow = args.workflow if args.workflow.is_dir() else this_dir.joinpath("microstructures", args.workflow)
+        num_tasks = submit(workflow, args.db, runs=args.runs, seed=args.seed)
+        print(f"Submitted {num_tasks} tasks. Start workers with: wfchef-distributed work {args.db}")
+    elif args.command == "work":
+        done = work(args.db, args.workflow, lease=args.lease, max_attempts=args.max_attempts, verbose=args.verbose)
+        print(f"Computed {done} tasks")
+    else:
+        conn = connect(args.db)
+        workflow = pathlib.Path(get_meta(conn)["workflow"])
+        conn.close()
+        out = args.out or workflow.joinpath("metric", "err.csv")
+        df = collect(args.db, out, cache_path=workflow.joinpath("metric", "err_cache.json"), max_attempts=args.max_attempts)
+        print(df)
+        print(f"Saved to {out}")
+
+if __name__ == "__main__":
+    main()
@@ -2,11 +2,14 @@ import pathlib
 import json
 import pickle 
 import networkx as nx
-from typing import Set, Optional, List, Union
+from typing import Any, Iterator, Set, Optional, List, Union, Dict, Tuple
 from uuid import uuid4
 
 import numpy as np
-from wfchef.utils import draw
+from wfchef.utils import draw, seed_random, string_hash
+from wfchef.export import write_columns
+from wfchef.store import LazyMicrostructures, read_base_index
+from collections.abc import Mapping, MutableMapping
 import random
 import argparse
 import pandas as pd 
@@ -17,12 +20,93 @@ this_dir = pathlib.Path(__file__).resolve().parent
 class NoMicrostructuresError(Exception):
     pass 
 
-def duplicate_nodes(graph: nx.DiGraph, nodes: Set[str]):
+class NodeAttributes(MutableMapping):
+    """Attributes of a duplicated node: a reference to the (shared, never modified) attributes of the node
+    it duplicates, its duplicate_of and, only if any are set on it later, its own attributes.
+
+    Duplicates of the same node share one table, so a synthetic node costs a few references instead of a
+    copy of label, type, id, level and the type hashes.
+    """
+    __slots__ = ("shared", "duplicate_of", "local")
+
+    def __init__(self, shared: Dict, duplicate_of: str) -> None:
+        self.shared = shared
+        self.duplicate_of = duplicate_of
+        self.local: Optional[Dict] = None
+
+    def __getitem__(self, key: str) -> Any:
+        if self.local is not None and key in self.local:
+            return self.local[key]
+        if key == "duplicate_of":
+            return self.duplicate_of
+        return self.shared[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key == "duplicate_of":
+            self.duplicate_of = value
+        else:
+            if self.local is None:
+                self.local = {}
+            self.local[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if self.local is not None and key in self.local:
+            del self.local[key]
+        elif key in self.shared or key == "duplicate_of":
+            raise KeyError(f"Cannot delete shared attribute {key} of a duplicated node")
+        else:
+            raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        yield from self.shared
+        yield "duplicate_of"
+        if self.local is not None:
+            yield from (key for key in self.local if key not in self.shared and key != "duplicate_of")
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def copy(self) -> "NodeAttributes":
+        attrs = NodeAttributes(self.shared, self.duplicate_of)
+        attrs.local = None if self.local is None else dict(self.local)
+        return attrs
+
+    def __repr__(self) -> str:
+        return repr(dict(self))
+
+def _add_node(graph: nx.DiGraph, node: str, attrs: NodeAttributes) -> None:
+    # networkx always stores node data in a new dict (graph.node_attr_dict_factory), so the only way to
+    # keep a NodeAttributes as the node's data is to put it in the (private) node dict of the graph
+    graph.add_node(node)
+    graph._node[node] = attrs
+
+def copy_graph(graph: nx.DiGraph) -> nx.DiGraph:
+    """Same as graph.copy(), but keeps the attributes of duplicated nodes shared (graph.copy() turns them into dicts)"""
+    copy = graph.__class__()
+    copy.graph.update(graph.graph)
+    for node, attrs in graph.nodes(data=True):
+        if isinstance(attrs, NodeAttributes):
+            _add_node(copy, node, attrs.copy())
+        else:
+            copy.add_node(node, **attrs)
+    copy.add_edges_from((src, dst, data.copy()) for src, dst, data in graph.edges(data=True))
+    return copy
+
+def duplicate_nodes(graph: nx.DiGraph, nodes: Set[str], tables: Optional[Dict[str, Dict]] = None):
+    """Adds a copy of nodes (and their edges) to graph. tables caches the shared attributes of
+    duplicated base graph nodes, pass the same dict to every call on a graph to share them."""
+    tables = {} if tables is None else tables
     new_nodes = {}
     for node in nodes:
         new_node = f"{node}_{uuid4()}"
-        graph.add_node(new_node, **graph.nodes[node])
-        nx.set_node_attributes(graph, {new_node: node}, "duplicate_of")
+        attrs = graph.nodes[node]
+        if isinstance(attrs, NodeAttributes) and attrs.local is None:
+            shared = attrs.shared
+        elif node in tables:
+            shared = tables[node]
+        else:
+            shared = tables[node] = {key: value for key, value in attrs.items() if key != "duplicate_of"}
+        _add_node(graph, new_node, NodeAttributes(shared, node))
         new_nodes[node] = new_node
     
     for node, new_node in new_nodes.items():
@@ -40,23 +124,44 @@ def duplicate_nodes(graph: nx.DiGraph, nodes: Set[str]):
     
     return new_nodes
 
-def duplicate(path: pathlib.Path, base: Union[str, pathlib.Path], num_nodes: int, interpolate_limit: Union[int, float] = np.inf) -> nx.DiGraph:
-    summary = json.loads(path.joinpath("summary.json").read_text())
+def load_summary(path: pathlib.Path) -> Dict:
+    return json.loads(path.joinpath("summary.json").read_text())
+
+def get_base_path(path: pathlib.Path, summary: Dict, base: Optional[Union[str, pathlib.Path]] = None) -> pathlib.Path:
     if base:
         base_path = pathlib.Path(base)
         if not base_path.is_absolute():
             base_path = path.joinpath(base_path)
     else:
         base_path = path.joinpath(min(summary["base_graphs"].keys(), key=lambda k: summary["base_graphs"][k]["order"]))
+    return base_path
 
+def load_base(base_path: pathlib.Path) -> Tuple[nx.DiGraph, Mapping]:
     graph = pickle.loads(base_path.joinpath("base_graph.pickle").read_bytes())
-    if num_nodes < graph.order():
-        raise ValueError(f"Cannot create synthentic graph with {num_nodes} nodes from base graph with {interpolate_limit} nodes")
+    index = read_base_index(base_path)
+    if index is not None:
+        microstructures = LazyMicrostructures(base_path.joinpath("microstructures.json"), index)
+    else:
+        microstructures = json.loads(base_path.joinpath("microstructures.json").read_text())
+    return graph, microstructures
+
+def select_base(summary: Dict, err: pd.DataFrame, num_tasks: int, exclude_graphs: Set[str] = set()) -> str:
+    """Picks the base graph with the lowest error for the reference graph closest in size to num_tasks"""
+    df = err.drop(exclude_graphs, axis=0, errors="ignore")
+    df = df.drop(exclude_graphs, axis=1, errors="ignore")
+    for col in df.columns:
+        df.loc[col, col] = np.nan
 
-    microstructures = json.loads(base_path.joinpath("microstructures.json").read_text())
+    reference_orders = [summary["base_graphs"][col]["order"] for col in df.columns]
+    idx = np.argmin([abs(num_tasks - ref_num_tasks) for ref_num_tasks in reference_orders])
+    reference = df.columns[idx]
 
+    return df.index[df[reference].argmin()]
+
+def get_probabilities(graph: nx.DiGraph, microstructures: Mapping, summary: Dict, num_nodes: int, interpolate_limit: Union[int, float] = np.inf) -> Tuple[List[str], np.ndarray]:
+    """Returns the names of the microstructures of graph and the probability of duplicating each one to reach num_nodes"""
     mss, freqs = [], []
-    for ms_hash, ms in sorted(microstructures.items(), key=lambda x: summary["frequencies"][x[0]], reverse=True):
+    for ms_hash in sorted(microstructures.keys(), key=lambda ms_hash: summary["frequencies"][ms_hash], reverse=True):
         if interpolate_limit:
             idx, values = zip(*summary["frequencies"][ms_hash])
         else:
@@ -65,16 +170,65 @@ def duplicate(path: pathlib.Path, base: Union[str, pathlib.Path], num_nodes: int
             except ValueError:
                 raise NoMicrostructuresError
 
-        mss.append(ms)
+        mss.append(ms_hash)
         freqs.append(int(interpolate(idx, values, num_nodes)))
     
     p: np.ndarray = np.array(freqs) / np.sum(freqs)
+    return mss, p
+
+def growth_fingerprint(base_fp: str, graph: nx.DiGraph, microstructures: Mapping, summary: Dict, num_nodes: int, interpolate_limit: Union[int, float] = np.inf) -> str:
+    """Hash of everything grow reads to grow a base graph to num_nodes: the base graph and its instances
+    (base_fp, see store.base_fingerprint) and the microstructures and probabilities get_probabilities returns.
+
+    Frequency points that do not change the interpolated probabilities (e.g. of an added instance) leave it unchanged.
+    """
+    try:
+        mss, p = get_probabilities(graph, microstructures, summary, num_nodes, interpolate_limit)
+    except NoMicrostructuresError:
+        return string_hash((base_fp, None))
+    return string_hash((base_fp, list(zip(mss, p.tolist()))))
+
+def grow(graph: nx.DiGraph, microstructures: Mapping, summary: Dict, num_nodes: int, interpolate_limit: Union[int, float] = np.inf) -> nx.DiGraph:
+    """Duplicates microstructures of graph (in place) until it has num_nodes nodes"""
+    if num_nodes < graph.order():
+        raise ValueError(f"Cannot create synthentic graph with {num_nodes} nodes from base graph with {interpolate_limit} nodes")
+
+    mss, p = get_probabilities(graph, microstructures, summary, num_nodes, interpolate_limit)
+    tables = {}
     while graph.order() < num_nodes:
-        ms = np.random.choice(mss, p=p)
-        duplicate_nodes(graph, random.choice(ms["nodes"]))
+        ms = microstructures[np.random.choice(mss, p=p)]
+        duplicate_nodes(graph, random.choice(ms["nodes"]), tables)
 
     return graph
 
+class Generator:
+    """select_base and generate for models of a workflow (see serve.Model and shared.SharedModel),
+    which set summary and err and implement load_base"""
+    summary: Mapping
+    err: Optional[pd.DataFrame] = None
+
+    def load_base(self, base: str) -> Tuple[nx.DiGraph, Mapping]:
+        raise NotImplementedError
+
+    def select_base(self, num_tasks: int, exclude_graphs: Set[str] = set()) -> str:
+        if self.err is None:
+            return min(self.summary["base_graphs"], key=lambda k: self.summary["base_graphs"][k]["order"])
+        return select_base(self.summary, self.err, num_tasks, exclude_graphs)
+
+    def generate(self, num_tasks: int, seed: Optional[int] = None, base: Optional[str] = None) -> Tuple[nx.DiGraph, str]:
+        """Same as duplicate (with the base graph picked by error, if the workflow has an err.csv).
+        seed is used like in the generated recipes (see utils.seed_random)."""
+        base = base or self.select_base(num_tasks)
+        graph, microstructures = self.load_base(base)
+        if seed is not None:
+            seed_random(seed)
+        return grow(graph.copy(), microstructures, self.summary, num_tasks), base
+
+def duplicate(path: pathlib.Path, base: Union[str, pathlib.Path], num_nodes: int, interpolate_limit: Union[int, float] = np.inf) -> nx.DiGraph:
+    summary = load_summary(path)
+    graph, microstructures = load_base(get_base_path(path, summary, base))
+    return grow(graph, microstructures, summary, num_nodes, interpolate_limit)
+
 def get_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -104,6 +258,10 @@ def get_parser():
         "-e", "--extension", default="png",
         help="Extension to save image, if not set default is png."
     )
+    parser.add_argument(
+        "-c", "--columns", type=pathlib.Path, default=None,
+        help="if set, also saves the graph as columnar arrays (npz) to this path"
+    )
 
     return parser
 
@@ -122,6 +280,9 @@ def main():
     path = this_dir.joinpath("microstructures", args.workflow)
     graph = duplicate(path, args.base, num_nodes=args.size)
     
+    if args.columns:
+        write_columns(graph, args.columns)
+
     duplicated = {node for node in graph.nodes if "duplicate_of" in graph.nodes[node]}
 
     draw(graph, save=args.out, extension=args.extension, close=True, subgraph=duplicated)
@@ -0,0 +1,128 @@
+import math
+import numpy as np
+import networkx as nx
+from typing import Dict, List, Tuple, Union
+from .duplicate import get_probabilities
+
+def type_hash_counts(graph: nx.DiGraph) -> Dict[str, int]:
+    counts = {}
+    for node in graph.nodes:
+        _type = graph.nodes[node]['type_hash']
+        counts.setdefault(_type, 0)
+        counts[_type] += 1
+    return counts
+
+def histogram_rmse(synthetic: Dict[str, float], real: Dict[str, float], real_order: int, variance: Dict[str, float] = {}) -> float:
+    """RMSE between type hash histograms, normalized by the order of the real graph.
+
+    If the variance of the synthetic histogram is given, returns the root of the expected squared error instead.
+    """
+    _types = {_type for _type, count in [*synthetic.items(), *real.items()] if count > 0}
+    mse = math.sqrt(sum([
+        (real.get(_type, 0) - synthetic.get(_type, 0))**2 + variance.get(_type, 0)
+        for _type in _types
+    ]) / len(_types))
+    return mse / real_order
+
+class CountModel:
+    """Type hash histograms of the graphs duplicate would grow from a base graph, without building them.
+
+    Every step of duplicate adds a copy of one microstructure instance, picked with probability
+    p[ms] / len(instances of ms), until the graph has num_nodes nodes. Only the type hash counts of
+    the instances are kept, so histograms can be computed exactly by sampling (sample) or
+    approximately in closed form (expected).
+
+    :param graph: annotated base graph.
+    :type graph: nx.DiGraph
+    :param microstructures: microstructures of the base graph.
+    :type microstructures: Dict
+    :param summary: summary of the workflow.
+    :type summary: Dict
+    :param num_nodes: number of nodes of the graphs to estimate.
+    :type num_nodes: int
+    """
+    def __init__(self,
+                 graph: nx.DiGraph,
+                 microstructures: Dict,
+                 summary: Dict,
+                 num_nodes: int,
+                 interpolate_limit: Union[int, float] = np.inf) -> None:
+        if num_nodes < graph.order():
+            raise ValueError(f"Cannot create synthentic graph with {num_nodes} nodes from base graph with {graph.order()} nodes")
+
+        mss, p = get_probabilities(graph, microstructures, summary, num_nodes, interpolate_limit)
+        base = type_hash_counts(graph)
+        self.types: List[str] = sorted(base.keys())
+        type_idx = {_type: i for i, _type in enumerate(self.types)}
+        self.base = np.array([base[_type] for _type in self.types], dtype=float)
+
+        rows, weights = [], []
+        for ms_hash, ms_p in zip(mss, p):
+            ms = microstructures[ms_hash]
+            for instance in ms["nodes"]:
+                row = np.zeros(len(self.types))
+                for node in instance:
+                    row[type_idx[graph.nodes[node]["type_hash"]]] += 1
+                rows.append(row)
+                weights.append(ms_p / len(ms["nodes"]))
+
+        self.counts = np.array(rows).reshape(len(rows), len(self.types))
+        self.weights = np.array(weights)
+        self.sizes = self.counts.sum(axis=1)
+        self.remaining = num_nodes - graph.order()
+
+    def to_dict(self, histogram: np.ndarray) -> Dict[str, float]:
+        return dict(zip(self.types, histogram))
+
+    def sample(self) -> Dict[str, float]:
+        """Type hash histogram of one graph, with the same distribution as duplicate's"""
+        if self.remaining <= 0:
+            return self.to_dict(self.base)
+
+        batch = int(1.25 * self.remaining / np.dot(self.weights, self.sizes)) + 16
+        picks = np.random.choice(len(self.weights), size=batch, p=self.weights)
+        total = np.cumsum(self.sizes[picks])
+        while total[-1] < self.remaining:
+            more = np.random.choice(len(self.weights), size=batch, p=self.weights)
+            picks = np.concatenate([picks, more])
+            total = np.concatenate([total, total[-1] + np.cumsum(self.sizes[more])])
+
+        steps = np.searchsorted(total, self.remaining) + 1
+        picked = np.bincount(picks[:steps], minlength=len(self.weights))
+        return self.to_dict(self.base + picked @ self.counts)
+
+    def expected(self) -> Tuple[Dict[str, float], Dict[str, float]]:
+        """Mean and variance of the type hash histograms from renewal theory, accurate once the graphs
+        are much larger than their microstructures (see check_expected)"""
+        if self.remaining <= 0:
+            return self.to_dict(self.base), self.to_dict(np.zeros(len(self.types)))
+
+        mean_size = np.dot(self.weights, self.sizes)
+        var_size = np.dot(self.weights, self.sizes**2) - mean_size**2
+        # the last microstructure overshoots num_nodes by (E[s^2] / E[s] - 1) / 2 on average
+        mean_steps = (self.remaining + (var_size / mean_size + mean_size - 1) / 2) / mean_size
+
+        mean_counts = self.weights @ self.counts
+        var_counts = self.weights @ self.counts**2 - mean_counts**2
+        cov_counts_size = self.weights @ (self.counts * self.sizes[:, None]) - mean_counts * mean_size
+        # renewal-reward: (r / E[s]) Var(c - E[c] / E[s] s). c and s are correlated (s is the sum of c)
+        ratio = mean_counts / mean_size
+        mean = self.base + mean_steps * mean_counts
+        variance = self.remaining / mean_size * (var_counts - 2 * ratio * cov_counts_size + ratio**2 * var_size)
+        return self.to_dict(mean), self.to_dict(np.maximum(variance, 0))
+
+def check_expected(model: CountModel, runs: int = 1000) -> Dict[str, Tuple[float, float, float, float]]:
+    """(analytic mean, sampled mean, analytic variance, sampled variance) of every type hash, to check expected against sample"""
+    mean, variance = model.expected()
+    samples = np.array([[sample[_type] for _type in model.types] for sample in (model.sample() for _ in range(runs))])
+    return {
+        _type: (mean[_type], samples[:, i].mean(), variance[_type], samples[:, i].var(ddof=1))
+        for i, _type in enumerate(model.types)
+    }
+
+def estimate_rmse(model: CountModel, real: Dict[str, int], real_order: int, runs: int = 1, analytic: bool = False) -> float:
+    """Median RMSE of runs sampled histograms against real, or the analytic expected RMSE"""
+    if analytic:
+        mean, variance = model.expected()
+        return histogram_rmse(mean, real, real_order, variance)
+    return np.median([histogram_rmse(model.sample(), real, real_order) for _ in range(runs)])
@@ -0,0 +1,94 @@
+import pathlib
+import zipfile
+import numpy as np
+import networkx as nx
+from typing import Dict, Union
+
+def to_columns(graph: nx.DiGraph) -> Dict[str, np.ndarray]:
+    """Flattens a (synthetic) graph into columnar arrays.
+
+    Nodes are numbered in graph order. "type" indexes "types", "duplicate_of" is the index of the node
+    a node was duplicated from (-1 for original nodes) and "runtime" is NaN for nodes without one.
+    Edges are stored in CSR form: the children of node i are indices[indptr[i]:indptr[i+1]].
+    """
+    nodes = list(graph.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    types = sorted({graph.nodes[node]["type"] for node in nodes})
+    type_index = {_type: i for i, _type in enumerate(types)}
+
+    indptr = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([graph.out_degree(node) for node in nodes])
+    indices = np.fromiter(
+        (index[child] for node in nodes for _, child in graph.out_edges(node)),
+        dtype=np.int64, count=indptr[-1]
+    )
+    return {
+        "id": np.array([str(node) for node in nodes]),
+        "types": np.array(types),
+        "type": np.fromiter((type_index[graph.nodes[node]["type"]] for node in nodes), dtype=np.int32, count=len(nodes)),
+        "runtime": np.fromiter((graph.nodes[node].get("runtime", np.nan) for node in nodes), dtype=np.float64, count=len(nodes)),
+        "duplicate_of": np.fromiter(
+            (index.get(graph.nodes[node].get("duplicate_of"), -1) for node in nodes),
+            dtype=np.int64, count=len(nodes)
+        ),
+        "indptr": indptr,
+        "indices": indices,
+    }
+
+def write_columns(graph: nx.DiGraph, path: Union[str, pathlib.Path]) -> None:
+    """Writes the columns of graph to an uncompressed npz file, so read_columns can memory-map it"""
+    with pathlib.Path(path).open("wb") as fp:
+        np.savez(fp, **to_columns(graph))
+
+def read_columns(path: Union[str, pathlib.Path], mmap: bool = True) -> Dict[str, np.ndarray]:
+    """Reads the columns written by write_columns.
+
+    If mmap is set, the arrays are read-only memory maps of the file instead of being read into memory.
+    """
+    path = pathlib.Path(path)
+    if not mmap:
+        with np.load(str(path)) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    columns = {}
+    with zipfile.ZipFile(str(path)) as zf, path.open("rb") as fp:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"Cannot memory-map compressed member {info.filename} of {path}")
+            # local file header: 30 bytes, then the name and the extra field
+            fp.seek(info.header_offset + 26)
+            name_length, extra_length = np.frombuffer(fp.read(4), dtype="<u2")
+            fp.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = np.lib.format.read_magic(fp)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(fp)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(fp)
+
+            name = info.filename[:-len(".npy")]
+            if 0 in shape:
+                columns[name] = np.empty(shape, dtype=dtype)
+            else:
+                columns[name] = np.memmap(
+                    str(path), dtype=dtype, mode="r", offset=fp.tell(),
+                    shape=shape, order="F" if fortran_order else "C"
+                )
+    return columns
+
+def from_columns(columns: Dict[str, np.ndarray]) -> nx.DiGraph:
+    """Rebuilds the nx.DiGraph of columns (with the type, runtime and duplicate_of attributes)"""
+    graph = nx.DiGraph()
+    ids = columns["id"]
+    for i, node in enumerate(ids):
+        attrs = {"type": str(columns["types"][columns["type"][i]])}
+        if not np.isnan(columns["runtime"][i]):
+            attrs["runtime"] = float(columns["runtime"][i])
+        if columns["duplicate_of"][i] >= 0:
+            attrs["duplicate_of"] = str(ids[columns["duplicate_of"][i]])
+        graph.add_node(str(node), **attrs)
+
+    indptr, indices = columns["indptr"], columns["indices"]
+    for i, node in enumerate(ids):
+        graph.add_edges_from((str(node), str(ids[child])) for child in indices[indptr[i]:indptr[i+1]])
+    return graph
@@ -12,6 +12,7 @@ import numpy as np
 from itertools import chain, combinations
 import argparse
 from .utils import create_graph, string_hash, type_hash, combine_hashes, annotate, draw
+from .store import index_microstructures, write_index
 import math 
 
 this_dir = pathlib.Path(__file__).resolve().parent
@@ -59,11 +60,11 @@ def find_microstructure(graph: nx.DiGraph, n1: str, n2: str):
 
     return n1_friends, n2_friends, common_friends, all_friends
 
-def find_microstructures(graph: nx.DiGraph, verbose: bool = False):
+def find_microstructures(graph: nx.DiGraph, verbose: bool = False, parents: Optional[Iterable[str]] = None):
     if verbose:
         print("Sorting nodes by type hash and parent")
     nodes_by_type_hash: Dict[str, Set[str]] = {}
-    for node in graph.nodes:
+    for node in (graph.nodes if parents is None else parents):
         for child in get_children(graph, node):
             th = graph.nodes[child]["type_hash"]
             nodes_by_type_hash.setdefault((node, th), set())
@@ -113,6 +114,59 @@ def sort_graphs(workflow_path: Union[pathlib.Path],
     sorted_graphs = sorted(graphs, key=lambda graph: len(graph.nodes))
     return sorted_graphs
 
+def save_graph_microstructures(graph: nx.DiGraph,
+                               savedir: pathlib.Path,
+                               verbose: bool = False,
+                               img_type: Optional[str] = 'png',
+                               highlight_all_instances: bool = False) -> Dict:
+    """Saves the base graph and microstructures of a single graph to savedir/<graph name>
+
+    Returns the index entry of the graph (see wfchef.store), with the frequency of each microstructure found.
+    """
+    if verbose:
+        print(f"Running for {graph.name}")
+    g_savedir = savedir.joinpath(graph.name)
+    g_savedir.mkdir(exist_ok=True, parents=True)
+
+    base_graph_path = g_savedir.joinpath("base_graph.pickle")
+    write_gpickle(graph, str(base_graph_path))
+
+    if img_type:
+        base_graph_image_path = g_savedir.joinpath(f"base_graph")
+        if verbose:
+            print(f"Drawing base graph to {base_graph_image_path}")
+        draw(graph, close=True, legend=False, extension= img_type, save=str(base_graph_image_path))
+
+    if verbose:
+        print("Finding microstructures")
+
+    microstructures = find_microstructures(graph, verbose=verbose)
+    mdatas = {}
+    for _, (ms_hash, instances) in enumerate(microstructures.items()):
+        ms_name = f"microstructure_{ms_hash}"
+
+        mdatas[ms_name] = {
+            "name": ms_name,
+            "nodes": list(map(list, instances)),
+            "frequency": len(instances),
+            "base_graph_path": str(base_graph_path),
+        }
+        if img_type:
+            print(f"Drawing {ms_name}")
+            draw(
+                graph, 
+                subgraph=list(instances)[0] if not highlight_all_instances else set.union(*instances),
+                with_labels=False, 
+                extension=img_type,
+                save=str(g_savedir.joinpath(ms_name)), 
+                close=True
+            )
+        
+    if verbose:
+        print()
+            
+    return index_microstructures(graph, g_savedir.joinpath("microstructures").with_suffix(".json"), mdatas)
+
 def save_microstructures(workflow_path: Union[pathlib.Path], 
                          savedir: pathlib.Path, 
                          verbose: bool = False, 
@@ -124,64 +178,24 @@ def save_microstructures(workflow_path: Union[pathlib.Path],
         "frequencies": {},
         "base_graphs": {}
     }
-    
+    indexes = {}
 
     for graph in sort_graphs(workflow_path, verbose):
         if graph.order() > cutoff:
             print(f'This and the next workflows have more than {cutoff} tasks')
             break
     
-        if verbose:
-            print(f"Running for {graph.name}")
-        g_savedir = savedir.joinpath(graph.name)
-        g_savedir.mkdir(exist_ok=True, parents=True)
-
-        base_graph_path = g_savedir.joinpath("base_graph.pickle")
-        write_gpickle(graph, str(base_graph_path))
         summary["base_graphs"][graph.name] = {
             "size": graph.size(),
             "order": graph.order()
         }
-
-        if img_type:
-            base_graph_image_path = g_savedir.joinpath(f"base_graph")
-            if verbose:
-                print(f"Drawing base graph to {base_graph_image_path}")
-            draw(graph, close=True, legend=False, extension= img_type, save=str(base_graph_image_path))
-
-        if verbose:
-            print("Finding microstructures")
-
-        microstructures = find_microstructures(graph, verbose=verbose)
-        mdatas = {}
-        for _, (ms_hash, instances) in enumerate(microstructures.items()):
-            ms_name = f"microstructure_{ms_hash}"
-
+        indexes[graph.name] = save_graph_microstructures(graph, savedir, verbose, img_type, highlight_all_instances)
+        for ms_name, entry in indexes[graph.name]["microstructures"].items():
             summary["frequencies"].setdefault(ms_name, [])
-            summary["frequencies"][ms_name].append((graph.order(), len(instances)))
-            mdatas[ms_name] = {
-                "name": ms_name,
-                "nodes": list(map(list, instances)),
-                "frequency": len(instances),
-                "base_graph_path": str(base_graph_path),
-            }
-            if img_type:
-                print(f"Drawing {ms_name}")
-                draw(
-                    graph, 
-                    subgraph=list(instances)[0] if not highlight_all_instances else set.union(*instances),
-                    with_labels=False, 
-                    extension=img_type,
-                    save=str(g_savedir.joinpath(ms_name)), 
-                    close=True
-                )
-            
-        if verbose:
-            print()
-                
-        g_savedir.joinpath("microstructures").with_suffix(".json").write_text(json.dumps(mdatas, indent=2)) 
+            summary["frequencies"][ms_name].append((graph.order(), entry["frequency"]))
 
     savedir.joinpath("summary").with_suffix(".json").write_text(json.dumps(summary, indent=2)) 
+    write_index(savedir, indexes)
         
 def get_parser() -> argparse.ArgumentParser:
     parser = argparse.ArgumentParser()
@@ -0,0 +1,162 @@
+import pathlib
+import pickle
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Optional, Set, Tuple, Union
+import networkx as nx
+from .utils import string_hash
+
+Key = Tuple[int, Tuple[str, ...]]
+
+class GraphPool:
+    """Pool of pre-generated graphs for the sizes that were requested, refilled in a background thread.
+
+    Every pooled graph is generated with its own seed and keeps it, with its base graph, in graph.graph
+    (generate must set graph.graph["base"]). If path is set, pooled graphs are also pickled there and
+    reused by the next pool opened on the same path. Once more than max_sizes sizes were requested,
+    the pool of the least recently requested size is dropped. A size that fails to generate in the
+    background is dropped too, and only pooled again once get generates it successfully.
+
+    :param generate: function generating a graph from (num_tasks, exclude_graphs, seed).
+    :type generate: Callable[[int, Set[str], int], nx.DiGraph]
+    :param depth: number of graphs to keep ready for each size.
+    :type depth: int
+    :param max_sizes: number of sizes to keep graphs for.
+    :type max_sizes: int
+    :param path: directory to keep the pooled graphs in.
+    :type path: Optional[Union[str, pathlib.Path]]
+    :param process: if set, the background thread generates graphs in a separate process (generate must be
+                    picklable). Otherwise it shares the global random state with the caller, so pooled graphs
+                    can only be reproduced from their seed if the caller does not use it concurrently.
+    :type process: bool
+    """
+    def __init__(self,
+                 generate: Callable[[int, Set[str], int], nx.DiGraph],
+                 depth: int = 4,
+                 max_sizes: int = 8,
+                 path: Optional[Union[str, pathlib.Path]] = None,
+                 process: bool = True) -> None:
+        self.generate = generate
+        self.depth = depth
+        self.max_sizes = max_sizes
+        self.path = pathlib.Path(path) if path else None
+        self._executor = ProcessPoolExecutor(1) if process else None
+
+        self._pools: "OrderedDict[Key, Deque[Dict]]" = OrderedDict()
+        self.errors: Dict[Key, Exception] = {} # sizes that failed to generate in the background
+        self._lock = threading.Lock()
+        self._generate_lock = threading.Lock() # generate seeds the global random state
+        self._wakeup = threading.Event()
+        self._stop = False
+        if self.path is not None:
+            self._load()
+
+        self._thread = threading.Thread(target=self._refill, daemon=True)
+        self._thread.start()
+        if self._pools:
+            self._wakeup.set()
+
+    def _key_path(self, key: Key) -> pathlib.Path:
+        return self.path.joinpath(string_hash(key)[:16])
+
+    def _load(self) -> None:
+        for key_path in sorted(self.path.glob("*/key.json"), key=lambda p: p.stat().st_mtime):
+            num_tasks, exclude_graphs = json.loads(key_path.read_text())
+            self._pools[(num_tasks, tuple(exclude_graphs))] = deque(
+                {"path": path, "graph": None} for path in sorted(key_path.parent.glob("*.pickle"))
+            )
+        while len(self._pools) > self.max_sizes:
+            evicted, _ = self._pools.popitem(last=False)
+            shutil.rmtree(self._key_path(evicted), ignore_errors=True)
+
+    def _generate(self, key: Key, background: bool = False) -> nx.DiGraph:
+        seed = int.from_bytes(os.urandom(4), "little")
+        if background and self._executor is not None:
+            graph = self._executor.submit(self.generate, key[0], set(key[1]), seed).result()
+        else:
+            with self._generate_lock:
+                graph = self.generate(key[0], set(key[1]), seed)
+        graph.graph["seed"] = seed
+        return graph
+
+    def _touch(self, key: Key) -> Deque[Dict]:
+        """Marks key as the most recently requested size and evicts the least recently requested ones"""
+        pool = self._pools.setdefault(key, deque())
+        self._pools.move_to_end(key)
+        if self.path is not None:
+            key_path = self._key_path(key)
+            if key_path.joinpath("key.json").exists():
+                key_path.joinpath("key.json").touch() # its mtime orders sizes when the pool is reopened
+            else:
+                key_path.mkdir(exist_ok=True, parents=True)
+                key_path.joinpath("key.json").write_text(json.dumps([key[0], list(key[1])]))
+        while len(self._pools) > self.max_sizes:
+            evicted, _ = self._pools.popitem(last=False)
+            if self.path is not None:
+                shutil.rmtree(self._key_path(evicted), ignore_errors=True)
+        return pool
+
+    def get(self, num_tasks: int, exclude_graphs: Set[str] = set()) -> nx.DiGraph:
+        """A pooled graph of num_tasks tasks if one is ready, otherwise a newly generated one"""
+        key = (num_tasks, tuple(sorted(exclude_graphs)))
+        with self._lock:
+            failed = key in self.errors
+            pool = None if failed else self._touch(key)
+            entry = pool.popleft() if pool else None
+        if not failed:
+            self._wakeup.set()
+
+        if entry is None:
+            graph = self._generate(key)
+            if failed:
+                with self._lock:
+                    self.errors.pop(key, None)
+            return graph
+        if entry["path"] is not None:
+            try:
+                graph = entry["graph"] if entry["graph"] is not None else pickle.loads(entry["path"].read_bytes())
+                entry["path"].unlink(missing_ok=True)
+            except FileNotFoundError: # evicted by another thread
+                return self._generate(key)
+            return graph
+        return entry["graph"]
+
+    def _refill(self) -> None:
+        while not self._stop:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while not self._stop:
+                with self._lock:
+                    missing = [key for key, pool in reversed(self._pools.items()) if len(pool) < self.depth]
+                if not missing:
+                    break
+
+                key = missing[0]
+                try:
+                    graph = self._generate(key, background=True)
+                except Exception as e:
+                    with self._lock:
+                        self.errors[key] = e
+                        if self._pools.pop(key, None) is not None and self.path is not None:
+                            shutil.rmtree(self._key_path(key), ignore_errors=True)
+                    continue
+                entry = {"path": None, "graph": graph}
+                if self.path is not None:
+                    entry["path"] = self._key_path(key).joinpath(f"{graph.graph['seed']}.pickle")
+                with self._lock:
+                    if key not in self._pools: # evicted while generating
+                        continue
+                    if entry["path"] is not None:
+                        entry["path"].write_bytes(pickle.dumps(graph))
+                    self._pools[key].append(entry)
+
+    def close(self) -> None:
+        self._stop = True
+        self._wakeup.set()
+        self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown()
@@ -0,0 +1,225 @@
+import pathlib
+import json
+import asyncio
+import argparse
+import os
+import random
+import pandas as pd
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple, Any, Union
+from .duplicate import load_summary, get_base_path, load_base, Generator
+from .shared import SharedModel
+
+this_dir = pathlib.Path(__file__).resolve().parent
+
+FORMATS = ["node_link", "edgelist"]
+
+class Model(Generator):
+    """Summary, error matrix and base graphs of a workflow, loaded once and kept in memory
+
+    :param path: directory with the summary.json and base graph directories of the workflow.
+    :type path: pathlib.Path
+    """
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = pathlib.Path(path)
+        self.summary = load_summary(self.path)
+        err_path = self.path.joinpath("metric", "err.csv")
+        self.err: Optional[pd.DataFrame] = pd.read_csv(str(err_path), index_col=0) if err_path.exists() else None
+        self.bases: Dict[str, Tuple[nx.DiGraph, Dict]] = {
+            base: load_base(get_base_path(self.path, self.summary, base))
+            for base in self.summary["base_graphs"]
+        }
+
+    def load_base(self, base: str) -> Tuple[nx.DiGraph, Dict]:
+        return self.bases[base]
+
+def serialize(graph: nx.DiGraph, _format: str) -> Any:
+    if _format == "node_link":
+        return nx.node_link_data(graph)
+    elif _format == "edgelist":
+        return {
+            "nodes": {node: graph.nodes[node]["type"] for node in graph.nodes},
+            "edges": list(graph.edges)
+        }
+    raise ValueError(f"Unknown format {_format}, expected one of {FORMATS}")
+
+_models: Dict[str, Union[Model, SharedModel]] = {}
+
+def _init_worker(workflows: Dict[str, pathlib.Path], handles: Optional[Dict[str, Dict]] = None) -> None:
+    for name, path in workflows.items():
+        _models[name] = SharedModel(handles[name]) if handles else Model(path)
+
+def _generate_batch(batch: List[Dict]) -> List[Dict]:
+    responses, done = [], {}
+    for request in batch:
+        key = (request["workflow"], request["num_tasks"], request["seed"], request["format"], request.get("base"))
+        if key not in done:
+            try:
+                graph, base = _models[request["workflow"]].generate(request["num_tasks"], request["seed"], request.get("base"))
+                done[key] = {
+                    "ok": True, "workflow": request["workflow"], "base": base, "seed": request["seed"],
+                    "num_tasks": graph.order(), "format": request["format"],
+                    "graph": serialize(graph, request["format"])
+                }
+            except Exception as e:
+                done[key] = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        responses.append(done[key])
+    return responses
+
+class GenerationServer:
+    """Serves synthetic graphs of warm workflow models to clients over newline-delimited JSON
+
+    Requests are batched (up to batch_size requests or batch_window seconds) and generated in a
+    process pool, each worker holding its own copy of the models (or, if shared is set, attached to
+    a single copy in shared memory, see wfchef.shared). Once max_pending requests are waiting, new
+    requests are answered with a "busy" error instead of being queued.
+    """
+    def __init__(self,
+                 workflows: Dict[str, pathlib.Path],
+                 workers: Optional[int] = None,
+                 max_pending: int = 1024,
+                 batch_size: int = 16,
+                 batch_window: float = 0.005,
+                 shared: bool = False) -> None:
+        self.workflows = workflows
+        self.shared = shared
+        self.workers = workers or os.cpu_count()
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.queue: Optional[asyncio.Queue] = None
+
+    def validate(self, request: Dict) -> Dict:
+        if not isinstance(request, dict):
+            raise TypeError(f"Expected a JSON object, got {type(request).__name__}")
+        if request.get("workflow") not in self.workflows:
+            raise ValueError(f"Unknown workflow {request.get('workflow')}, expected one of {list(self.workflows)}")
+        request["num_tasks"] = int(request["num_tasks"])
+        if request.get("seed") is None:
+            request["seed"] = random.randrange(2**32)
+        request["seed"] = int(request["seed"])
+        request.setdefault("format", "node_link")
+        if request["format"] not in FORMATS:
+            raise ValueError(f"Unknown format {request['format']}, expected one of {FORMATS}")
+        return request
+
+    async def submit(self, request: Dict) -> Dict:
+        try:
+            request = self.validate(request)
+        except (KeyError, TypeError, ValueError) as e:
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        if self.queue.full():
+            return {"ok": False, "error": "busy"}
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((request, future))
+        return await future
+
+    async def run_batch(self, batch: List[Tuple[Dict, asyncio.Future]], slots: asyncio.Semaphore) -> None:
+        try:
+            responses = await asyncio.get_running_loop().run_in_executor(
+                self.pool, _generate_batch, [request for request, _ in batch]
+            )
+        except Exception as e:
+            responses = [{"ok": False, "error": f"{type(e).__name__}: {e}"}] * len(batch)
+        finally:
+            slots.release()
+        for (_, future), response in zip(batch, responses):
+            if not future.done():
+                future.set_result(response)
+
+    async def batcher(self) -> None:
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.workers)
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await slots.acquire()
+            loop.create_task(self.run_batch(batch, slots))
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    response = await self.submit(json.loads(line))
+                except ValueError as e: # invalid JSON or not UTF-8
+                    response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+                writer.write(json.dumps(response).encode("utf-8") + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, socket_path: Optional[pathlib.Path] = None, host: str = "127.0.0.1", port: int = 8765) -> None:
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        shared_models = {name: SharedModel.publish(path) for name, path in self.workflows.items()} if self.shared else {}
+        handles = {name: model.handle for name, model in shared_models.items()}
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.workflows, handles))
+        # start the workers (and load the models) before accepting requests
+        await asyncio.gather(*[
+            asyncio.get_running_loop().run_in_executor(self.pool, _generate_batch, [])
+            for _ in range(self.workers)
+        ])
+        if socket_path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=str(socket_path), limit=2**26)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port, limit=2**26)
+
+        batcher = asyncio.get_running_loop().create_task(self.batcher())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            self.pool.shutdown(cancel_futures=True)
+            for model in shared_models.values():
+                model.close()
+
+def get_workflows(workflows: List[str]) -> Dict[str, pathlib.Path]:
+    paths = {}
+    for workflow in workflows:
+        name, _, path = workflow.partition("=")
+        paths[name] = pathlib.Path(path).resolve() if path else this_dir.joinpath("microstructures", name)
+    return paths
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-w", "--workflow", action="append", required=True,
+        help="workflow to serve, either the name of a workflow in wfchef/microstructures or name=path/to/microstructures. Can be repeated."
+    )
+    parser.add_argument("-u", "--socket", type=pathlib.Path, default=None, help="unix socket to listen on. If not set, listens on --host and --port.")
+    parser.add_argument("--host", default="127.0.0.1", help="host to listen on")
+    parser.add_argument("-p", "--port", type=int, default=8765, help="port to listen on")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="number of worker processes. Default is the number of cpus.")
+    parser.add_argument("-q", "--max-pending", type=int, default=1024, help="number of waiting requests before answering busy")
+    parser.add_argument("-b", "--batch-size", type=int, default=16, help="max number of requests sent to a worker at once")
+    parser.add_argument("-s", "--shared", action="store_true", help="if set, load the models once in shared memory instead of once per worker")
+
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    server = GenerationServer(
+        get_workflows(args.workflow), workers=args.workers,
+        max_pending=args.max_pending, batch_size=args.batch_size, shared=args.shared
+    )
+    try:
+        asyncio.run(server.serve(args.socket, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
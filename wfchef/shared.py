@@ -0,0 +1,247 @@
+import pathlib
+import json
+import mmap
+from collections.abc import Mapping, Sequence
+from multiprocessing import shared_memory
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+import numpy as np
+import pandas as pd
+import networkx as nx
+from .duplicate import load_summary, get_base_path, load_base, Generator
+
+ALIGN = 64
+
+class _Layout:
+    """Collects the flat arrays (and strings) of a model before they are copied to shared memory"""
+    def __init__(self) -> None:
+        self.arrays: Dict[str, np.ndarray] = {}
+        self.strings: Dict[str, int] = {}
+
+    def string(self, value: str) -> int:
+        return self.strings.setdefault(value, len(self.strings))
+
+    def finish(self) -> Tuple[Dict[str, Tuple[int, str, Tuple[int, ...]]], int]:
+        blobs = [value.encode("utf-8") for value in self.strings]
+        self.arrays["strings"] = np.frombuffer(b"".join(blobs), dtype=np.uint8)
+        self.arrays["string_offsets"] = np.concatenate([[0], np.cumsum([len(blob) for blob in blobs])]).astype(np.int64)
+
+        manifest, offset = {}, 0
+        for name, array in self.arrays.items():
+            manifest[name] = (offset, array.dtype.str, array.shape)
+            offset += (array.nbytes + ALIGN - 1) // ALIGN * ALIGN
+        return manifest, max(offset, 1)
+
+    def write(self, buf: memoryview, manifest: Dict) -> None:
+        for name, array in self.arrays.items():
+            offset, _, _ = manifest[name]
+            buf[offset:offset + array.nbytes] = np.ascontiguousarray(array).tobytes()
+
+class _Instances(Sequence):
+    """Instances of a microstructure, read from the shared arrays when indexed (so random.choice needs no copy)"""
+    def __init__(self, model: "SharedModel", base: str, start: int, stop: int) -> None:
+        self.model = model
+        self.base = base
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, i: int) -> List[str]:
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        ptr = self.model.array(f"{self.base}/instance_ptr")
+        nodes = self.model.array(f"{self.base}/instance_nodes")[ptr[self.start + i]:ptr[self.start + i + 1]]
+        names = self.model.array(f"{self.base}/names")
+        return [self.model.string(names[node]) for node in nodes]
+
+class _Microstructures(Mapping):
+    """Same content as a base graph's microstructures.json, backed by the shared arrays"""
+    def __init__(self, model: "SharedModel", base: str) -> None:
+        self.model = model
+        self.base = base
+        self.names = model.manifest["bases"][base]["microstructures"]
+        self.index = {ms_name: i for i, ms_name in enumerate(self.names)}
+
+    def __getitem__(self, ms_name: str) -> Dict:
+        i = self.index[ms_name]
+        ptr = self.model.array(f"{self.base}/ms_ptr")
+        instances = _Instances(self.model, self.base, int(ptr[i]), int(ptr[i + 1]))
+        return {"name": ms_name, "nodes": instances, "frequency": len(instances)}
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.names)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+class _Frequencies(Mapping):
+    """Same content as the summary's frequencies ([order, frequency] points of every microstructure), backed by the shared arrays"""
+    def __init__(self, model: "SharedModel") -> None:
+        self.model = model
+        self.index = {ms_name: i for i, ms_name in enumerate(model.manifest["frequencies"])}
+
+    def __getitem__(self, ms_name: str) -> List[List[int]]:
+        i = self.index[ms_name]
+        ptr = self.model.array("frequencies/ptr")
+        return self.model.array("frequencies/points")[ptr[i]:ptr[i + 1]].tolist()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+class SharedModel(Generator):
+    """A workflow's summary, error matrix, base graphs and microstructures stored once as flat arrays,
+    in shared memory or in a memory-mapped file, so that worker processes can attach to them read-only
+    instead of each loading its own copy.
+
+    Publish it in the parent process and attach in the workers with the handle::
+
+        model = SharedModel.publish(path)
+        with ProcessPoolExecutor(initializer=init, initargs=(model.handle,)) as pool:
+            ...
+        model.close()
+
+    :param handle: the handle of a published model.
+    :type handle: Dict
+    """
+    def __init__(self, handle: Dict) -> None:
+        self.handle = handle
+        self.manifest = handle["manifest"]
+        self._shm: Optional[shared_memory.SharedMemory] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._owner = False
+        if handle.get("file"):
+            with open(handle["file"], "rb") as fp:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            self.buf = memoryview(self._mmap)
+        else:
+            self._shm = shared_memory.SharedMemory(name=handle["shm"])
+            self.buf = self._shm.buf
+        self._arrays: Dict[str, np.ndarray] = {}
+        self._bases: Dict[str, Tuple[nx.DiGraph, Mapping]] = {}
+        self.summary = {"frequencies": _Frequencies(self), "base_graphs": self.manifest["base_graphs"]}
+        self.err: Optional[pd.DataFrame] = None
+        if self.manifest["err"] is not None:
+            self.err = pd.DataFrame(self.array("err"), **self.manifest["err"])
+
+    @classmethod
+    def publish(cls, path: Union[str, pathlib.Path], file: Optional[Union[str, pathlib.Path]] = None) -> "SharedModel":
+        """Loads the workflow at path and copies it to shared memory (or to file, if set)"""
+        path = pathlib.Path(path)
+        summary = load_summary(path)
+        err_path = path.joinpath("metric", "err.csv")
+        err = pd.read_csv(str(err_path), index_col=0) if err_path.exists() else None
+
+        layout = _Layout()
+        bases = {}
+        for base in summary["base_graphs"]:
+            graph, microstructures = load_base(get_base_path(path, summary, base))
+            index = {node: i for i, node in enumerate(graph.nodes)}
+            layout.arrays[f"{base}/names"] = np.array([layout.string(node) for node in graph.nodes], dtype=np.int32)
+
+            attrs = sorted({key for node in graph.nodes for key in graph.nodes[node]})
+            for key in attrs:
+                # values are stored as JSON, so non-string attributes (like level) survive
+                layout.arrays[f"{base}/attr/{key}"] = np.array([
+                    layout.string(json.dumps(graph.nodes[node][key])) if key in graph.nodes[node] else -1
+                    for node in graph.nodes
+                ], dtype=np.int32)
+            layout.arrays[f"{base}/edges"] = np.array(
+                [(index[src], index[dst]) for src, dst in graph.edges], dtype=np.int32
+            ).reshape(-1, 2)
+
+            ms_ptr, instance_ptr, instance_nodes = [0], [0], []
+            for ms in microstructures.values():
+                for instance in ms["nodes"]:
+                    instance_nodes.extend(index[node] for node in instance)
+                    instance_ptr.append(len(instance_nodes))
+                ms_ptr.append(len(instance_ptr) - 1)
+            layout.arrays[f"{base}/ms_ptr"] = np.array(ms_ptr, dtype=np.int64)
+            layout.arrays[f"{base}/instance_ptr"] = np.array(instance_ptr, dtype=np.int64)
+            layout.arrays[f"{base}/instance_nodes"] = np.array(instance_nodes, dtype=np.int32)
+
+            bases[base] = {"attrs": attrs, "graph": graph.graph, "microstructures": list(microstructures.keys())}
+
+        freq_names = list(summary["frequencies"].keys())
+        points = [point for ms_name in freq_names for point in summary["frequencies"][ms_name]]
+        layout.arrays["frequencies/points"] = np.array(points).reshape(-1, 2)
+        layout.arrays["frequencies/ptr"] = np.concatenate(
+            [[0], np.cumsum([len(summary["frequencies"][ms_name]) for ms_name in freq_names])]
+        ).astype(np.int64)
+        if err is not None:
+            layout.arrays["err"] = err.to_numpy(dtype=np.float64)
+
+        arrays, size = layout.finish()
+        manifest = {
+            "arrays": arrays,
+            "bases": bases,
+            "base_graphs": summary["base_graphs"],
+            "frequencies": freq_names,
+            "err": {"index": list(err.index), "columns": list(err.columns)} if err is not None else None
+        }
+        if file is not None:
+            with open(file, "wb") as fp:
+                fp.truncate(size)
+            with open(file, "r+b") as fp, mmap.mmap(fp.fileno(), size) as buf:
+                layout.write(memoryview(buf), arrays)
+            model = cls({"file": str(file), "manifest": manifest})
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=size)
+            layout.write(shm.buf, arrays)
+            model = cls({"shm": shm.name, "manifest": manifest})
+            shm.close()
+        model._owner = True
+        return model
+
+    def array(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            offset, dtype, shape = self.manifest["arrays"][name]
+            count = int(np.prod(shape))
+            array = np.frombuffer(self.buf, dtype=dtype, count=count, offset=offset).reshape(shape)
+            array.flags.writeable = False
+            self._arrays[name] = array
+        return self._arrays[name]
+
+    def string(self, i: int) -> str:
+        offsets = self.array("string_offsets")
+        return bytes(self.array("strings")[offsets[i]:offsets[i + 1]]).decode("utf-8")
+
+    def load_base(self, base: str) -> Tuple[nx.DiGraph, Mapping]:
+        """The base graph and a read-only view of its microstructures, decoded once per process (copy the graph to grow it)"""
+        if base not in self._bases:
+            self._bases[base] = self._decode_base(base)
+        return self._bases[base]
+
+    def _decode_base(self, base: str) -> Tuple[nx.DiGraph, Mapping]:
+        info = self.manifest["bases"][base]
+        names = [self.string(i) for i in self.array(f"{base}/names")]
+        columns = {key: self.array(f"{base}/attr/{key}") for key in info["attrs"]}
+
+        graph = nx.DiGraph(**info["graph"])
+        for i, node in enumerate(names):
+            graph.add_node(node, **{
+                key: json.loads(self.string(column[i]))
+                for key, column in columns.items() if column[i] >= 0
+            })
+        graph.add_edges_from((names[src], names[dst]) for src, dst in self.array(f"{base}/edges"))
+        return graph, _Microstructures(self, base)
+
+    def close(self) -> None:
+        """Detaches from the model, and frees it if this process published it"""
+        self._arrays.clear()
+        self._bases.clear()
+        self.err = None
+        self.buf = None
+        if self._mmap is not None:
+            self._mmap.close()
+            if self._owner:
+                pathlib.Path(self.handle["file"]).unlink(missing_ok=True)
+        if self._shm is not None:
+            self._shm.close()
+            if self._owner:
+                self._shm.unlink()
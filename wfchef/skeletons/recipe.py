@@ -15,14 +15,16 @@ from workflowhub.common.file import FileLink
 from workflowhub.common.task import Task
 from workflowhub.common.workflow import Workflow
 
-from wfchef.duplicate import duplicate_nodes, duplicate
+from wfchef.duplicate import duplicate_nodes, duplicate, select_base, copy_graph
+from wfchef.export import write_columns
+from wfchef.pool import GraphPool
+from wfchef.utils import seed_random
 
 from itertools import product
 import pathlib 
 import pickle
 import networkx as nx
 import random
-import numpy as np
 import pandas as pd
 import json
 from uuid import uuid4
@@ -53,24 +55,46 @@ class SkeletonRecipe(WorkflowRecipe):
             for node in self.graph.nodes
         ]
 
+    pool: Optional[GraphPool] = None
+
+    @classmethod
+    def enable_pool(cls, 
+                    depth: int = 4, 
+                    max_sizes: int = 8, 
+                    path: Optional[Union[str, pathlib.Path]] = None) -> GraphPool:
+        """
+        Keep pre-generated graphs for the requested numbers of tasks, so :meth:`from_num_tasks`
+        does not wait for them to be generated. Graphs are refilled in a background thread.
+
+        :param depth: The number of graphs to keep ready for each number of tasks.
+        :type depth: int
+        :param max_sizes: The number of different numbers of tasks to keep graphs for (least recently requested are dropped).
+        :type max_sizes: int
+        :param path: A directory to also keep the graphs in, so they are reused across processes.
+        :type path: Optional[Union[str, pathlib.Path]]
+
+        :return: The pool of graphs.
+        :rtype: GraphPool
+        """
+        if cls.pool is not None:
+            cls.pool.close()
+        cls.pool = GraphPool(cls.generate_nx_graph, depth=depth, max_sizes=max_sizes, path=path)
+        return cls.pool
+
     @classmethod
-    def generate_nx_graph(cls, num_tasks: int, exclude_graphs: Set[str]) -> nx.DiGraph:
+    def generate_nx_graph(cls, num_tasks: int, exclude_graphs: Set[str], seed: Optional[int] = None) -> nx.DiGraph:
+        if seed is not None:
+            seed_random(seed)
         summary_path = this_dir.joinpath("microstructures", "summary.json")
         summary = json.loads(summary_path.read_text())
 
         metric_path = this_dir.joinpath("metric", "err.csv")
         df = pd.read_csv(str(metric_path), index_col=0)
-        df = df.drop(exclude_graphs, axis=0, errors="ignore")
-        df = df.drop(exclude_graphs, axis=1, errors="ignore")
-        for col in df.columns:
-            df.loc[col, col] = np.nan
+        base = select_base(summary, df, num_tasks, exclude_graphs)
 
-        reference_orders = [summary["base_graphs"][col]["order"] for col in df.columns]
-        idx = np.argmin([abs(num_tasks - ref_num_tasks) for ref_num_tasks in reference_orders])
-        reference = df.columns[idx]
-
-        base = df.index[df[reference].argmin()]
         graph = duplicate(this_dir.joinpath("microstructures"), base, num_tasks)
+        graph.graph["base"] = base
+        graph.graph["seed"] = seed
         return graph
 
     @classmethod
@@ -86,7 +110,11 @@ class SkeletonRecipe(WorkflowRecipe):
                  to the total number of tasks provided.
         :rtype: SkeletonRecipe
         """
-        return SkeletonRecipe(graph=cls.generate_nx_graph(num_tasks, exclude_graphs), num_tasks=num_tasks)
+        if cls.pool is not None:
+            graph = cls.pool.get(num_tasks, exclude_graphs)
+        else:
+            graph = cls.generate_nx_graph(num_tasks, exclude_graphs)
+        return SkeletonRecipe(graph=graph, num_tasks=num_tasks)
 
     def _load_base_graph(self) -> nx.DiGraph:
         return pickle.loads(this_dir.joinpath("base_graph.pickle").read_bytes())
@@ -104,7 +132,7 @@ class SkeletonRecipe(WorkflowRecipe):
         :rtype: Workflow
         """
         workflow = Workflow(name=self.name + "-synthetic-trace" if not workflow_name else workflow_name, makespan=None)
-        graph = self.graph.copy()
+        graph = copy_graph(self.graph)
 
         task_names = {}
         for node in graph.nodes:
@@ -114,6 +142,7 @@ class SkeletonRecipe(WorkflowRecipe):
             task_name = self._generate_task_name(node_type)
             task = self._generate_task(node_type, task_name)
             workflow.add_node(task_name, task=task)
+            graph.nodes[node]["runtime"] = task.runtime
 
             task_names[node] = task_name
 
@@ -126,6 +155,18 @@ class SkeletonRecipe(WorkflowRecipe):
         self.workflows.append(workflow)
         return workflow
 
+    def write_columns(self, path: Union[str, pathlib.Path], workflow: Optional[Workflow] = None) -> None:
+        """Write a synthetic workflow as columnar arrays (task id, type, runtime, duplicate_of and
+        a CSR edge list) to an npz file, which can be memory-mapped with :func:`wfchef.export.read_columns`.
+
+        :param path: The path of the npz file
+        :type path: Union[str, pathlib.Path]
+        :param workflow: The workflow to write, the last built one if not set.
+        :type workflow: Optional[Workflow]
+        """
+        workflow = workflow or self.workflows[-1]
+        write_columns(workflow.nxgraph, path)
+
     def _workflow_recipe(self) -> Dict:
         """
         Recipe for generating synthetic traces of the Skeleton workflow. Recipes can be
@@ -0,0 +1,259 @@
+import pathlib
+import json
+import hashlib
+import pickle
+import argparse
+import networkx as nx
+from collections.abc import Mapping
+from typing import Dict, List, Optional, Tuple, Union, Iterator
+from .utils import string_hash
+
+this_dir = pathlib.Path(__file__).resolve().parent
+
+def graph_fingerprint(graph: nx.DiGraph) -> str:
+    return string_hash((
+        sorted((str(node), graph.nodes[node]["type_hash"]) for node in graph.nodes),
+        sorted((str(src), str(dst)) for src, dst in graph.edges)
+    ))
+
+def base_fingerprint(graph: nx.DiGraph, microstructures: Mapping) -> str:
+    """Hash of a base graph and the instances of its microstructures"""
+    return string_hash((
+        graph_fingerprint(graph),
+        sorted(
+            (ms_hash, sorted(sorted(instance) for instance in ms["nodes"]))
+            for ms_hash, ms in microstructures.items()
+        )
+    ))
+
+def cell_key(kind: str, growth_fp: str, real: Dict[str, int], *params) -> str:
+    """Key of an error matrix cell in the err_cache.json of a store (see chef.find_err)"""
+    return string_hash((kind, growth_fp, string_hash(sorted(real.items())), *params))
+
+def write_microstructures(path: pathlib.Path, mdatas: Dict[str, Dict]) -> Dict[str, Tuple[int, int]]:
+    """Writes mdatas as a JSON object, one microstructure per line.
+
+    Returns the byte offset and length of each microstructure's value, so it can be read without parsing the file.
+    """
+    offsets = {}
+    with path.open("wb") as fp:
+        fp.write(b"{")
+        for i, (ms_name, mdata) in enumerate(mdatas.items()):
+            fp.write(b"," if i else b"")
+            fp.write(b"\n  " + json.dumps(ms_name).encode("utf-8") + b": ")
+            value = json.dumps(mdata).encode("utf-8")
+            offsets[ms_name] = (fp.tell(), len(value))
+            fp.write(value)
+        fp.write(b"\n}\n")
+    return offsets
+
+def file_hash(path: pathlib.Path) -> str:
+    digest = hashlib.sha1()
+    with path.open("rb") as fp:
+        for chunk in iter(lambda: fp.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def index_microstructures(graph: nx.DiGraph, path: pathlib.Path, mdatas: Dict[str, Dict]) -> Dict:
+    """Writes the microstructures of graph to path and returns their index entry"""
+    offsets = write_microstructures(path, mdatas)
+    microstructures = {}
+    for ms_name, mdata in mdatas.items():
+        types = {}
+        for instance in mdata["nodes"]:
+            counts = {}
+            for node in instance:
+                _type = graph.nodes[node]["type"]
+                counts[_type] = counts.get(_type, 0) + 1
+            for _type, count in counts.items():
+                types[_type] = max(types.get(_type, 0), count)
+
+        sizes = [len(instance) for instance in mdata["nodes"]]
+        microstructures[ms_name] = {
+            "frequency": mdata["frequency"],
+            "size": max(sizes),
+            "min_size": min(sizes),
+            "types": types,
+            "offset": offsets[ms_name][0],
+            "length": offsets[ms_name][1],
+        }
+    stat = path.stat()
+    return {
+        "file_size": stat.st_size,
+        "file_mtime_ns": stat.st_mtime_ns,
+        "file_sha1": file_hash(path),
+        "microstructures": microstructures
+    }
+
+def write_index(savedir: pathlib.Path, indexes: Dict[str, Dict]) -> None:
+    savedir.joinpath("index.json").write_text(json.dumps({"bases": indexes}, indent=2))
+
+def read_base_index(base_path: pathlib.Path) -> Optional[Dict]:
+    """Index entry of a base graph directory, or None if its store has no (up to date) index"""
+    index_path = base_path.parent.joinpath("index.json")
+    ms_path = base_path.joinpath("microstructures.json")
+    if not index_path.exists() or not ms_path.exists():
+        return None
+    index = json.loads(index_path.read_text())["bases"].get(base_path.name)
+    if index is None or "file_sha1" not in index:
+        return None
+    stat = ms_path.stat()
+    if index["file_size"] != stat.st_size:
+        return None
+    # same size and mtime: unchanged. Same size only (e.g. copied to a recipe): compare the content
+    if index["file_mtime_ns"] != stat.st_mtime_ns and index["file_sha1"] != file_hash(ms_path):
+        return None
+    return index
+
+class LazyMicrostructures(Mapping):
+    """Read-only mapping with the same content as a base graph's microstructures.json,
+    which only reads a microstructure from disk the first time it is accessed.
+
+    :param path: path to microstructures.json.
+    :type path: pathlib.Path
+    :param index: index entry of the base graph.
+    :type index: Dict
+    """
+    def __init__(self, path: pathlib.Path, index: Dict) -> None:
+        self.path = path
+        self.index = index
+        self._loaded: Dict[str, Dict] = {}
+
+    def __getitem__(self, ms_name: str) -> Dict:
+        if ms_name not in self._loaded:
+            entry = self.index["microstructures"][ms_name]
+            with self.path.open("rb") as fp:
+                fp.seek(entry["offset"])
+                self._loaded[ms_name] = json.loads(fp.read(entry["length"]))
+        return self._loaded[ms_name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index["microstructures"])
+
+    def __len__(self) -> int:
+        return len(self.index["microstructures"])
+
+class MicrostructureStore:
+    """Queries over the index of a microstructure store (the output of wfchef-find-microstructures)
+
+    :param path: directory of the store.
+    :type path: Union[str, pathlib.Path]
+    """
+    def __init__(self, path: Union[str, pathlib.Path]) -> None:
+        self.path = pathlib.Path(path)
+        index_path = self.path.joinpath("index.json")
+        if not index_path.exists():
+            raise FileNotFoundError(f"{index_path} does not exist, run: wfchef-store index {self.path}")
+        self.bases: Dict[str, Dict] = json.loads(index_path.read_text())["bases"]
+
+    def microstructures(self) -> Dict[str, Dict]:
+        """Metadata of every microstructure, merged over the base graphs it was found in"""
+        merged = {}
+        for base, index in self.bases.items():
+            for ms_name, entry in index["microstructures"].items():
+                ms = merged.setdefault(ms_name, {"size": 0, "min_size": entry["min_size"], "types": {}, "frequencies": {}})
+                ms["size"] = max(ms["size"], entry["size"])
+                ms["min_size"] = min(ms["min_size"], entry["min_size"])
+                for _type, count in entry["types"].items():
+                    ms["types"][_type] = max(ms["types"].get(_type, 0), count)
+                ms["frequencies"][base] = entry["frequency"]
+        return merged
+
+    def query(self,
+              min_frequency: Optional[int] = None,
+              contains_type: Optional[str] = None,
+              base: Optional[str] = None,
+              min_size: Optional[int] = None,
+              max_size: Optional[int] = None) -> Dict[str, Dict]:
+        """Microstructures with at least min_frequency instances in some base graph (or in base, if set),
+        containing a task of type contains_type and with instances between min_size and max_size tasks.
+        """
+        matches = {}
+        for ms_name, ms in self.microstructures().items():
+            if base and base not in ms["frequencies"]:
+                continue
+            frequencies = [ms["frequencies"][base]] if base else ms["frequencies"].values()
+            if min_frequency is not None and max(frequencies) < min_frequency:
+                continue
+            if contains_type is not None and contains_type not in ms["types"]:
+                continue
+            if min_size is not None and ms["size"] < min_size:
+                continue
+            if max_size is not None and ms["min_size"] > max_size:
+                continue
+            matches[ms_name] = ms
+        return matches
+
+    def largest(self, base: Optional[str] = None) -> Optional[str]:
+        microstructures = self.query(base=base)
+        if not microstructures:
+            return None
+        return max(microstructures, key=lambda ms_name: microstructures[ms_name]["size"])
+
+    def load(self, base: str) -> LazyMicrostructures:
+        return LazyMicrostructures(self.path.joinpath(base, "microstructures.json"), self.bases[base])
+
+    def instances(self, base: str, ms_name: str) -> List[List[str]]:
+        return self.load(base)[ms_name]["nodes"]
+
+def reindex(path: pathlib.Path) -> None:
+    """Builds the index of a store mined before indexes existed (rewrites every microstructures.json)"""
+    summary = json.loads(path.joinpath("summary.json").read_text())
+    indexes = {}
+    for base in summary["base_graphs"]:
+        graph = pickle.loads(path.joinpath(base, "base_graph.pickle").read_bytes())
+        ms_path = path.joinpath(base, "microstructures.json")
+        indexes[base] = index_microstructures(graph, ms_path, json.loads(ms_path.read_text()))
+    write_index(path, indexes)
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["index", "query", "show"], help="index: (re)build the index of a store. query: list microstructures. show: print the instances of a microstructure.")
+    parser.add_argument("path", help="directory of the store, or name of a workflow in wfchef/microstructures")
+    parser.add_argument("microstructure", nargs="?", default=None, help="microstructure to show")
+    parser.add_argument("-b", "--base", default=None, help="only consider this base graph")
+    parser.add_argument("-f", "--min-frequency", type=int, default=None, help="only microstructures with at least this many instances")
+    parser.add_argument("-t", "--type", default=None, help="only microstructures with a task of this type")
+    parser.add_argument("--min-size", type=int, default=None, help="only microstructures with instances of at least this many tasks")
+    parser.add_argument("--max-size", type=int, default=None, help="only microstructures with instances of at most this many tasks")
+    parser.add_argument("-l", "--largest", action="store_true", help="only print the largest microstructure")
+
+    return parser
+
+def main():
+    parser = get_parser()
+    args = parser.parse_args()
+    path = pathlib.Path(args.path)
+    if not path.is_dir():
+        path = this_dir.joinpath("microstructures", args.path)
+
+    if args.command == "index":
+        reindex(path)
+        return
+
+    store = MicrostructureStore(path)
+    if args.command == "show":
+        if args.microstructure is None:
+            parser.error("show requires a microstructure")
+        bases = [args.base] if args.base else [
+            base for base, index in store.bases.items() if args.microstructure in index["microstructures"]
+        ]
+        for base in bases:
+            print(f"{base}:")
+            for instance in store.instances(base, args.microstructure):
+                print(f"  {' '.join(sorted(instance))}")
+        return
+
+    matches = store.query(
+        min_frequency=args.min_frequency, contains_type=args.type, base=args.base,
+        min_size=args.min_size, max_size=args.max_size
+    )
+    if args.largest and matches:
+        largest = max(matches, key=lambda ms_name: matches[ms_name]["size"])
+        matches = {largest: matches[largest]}
+    for ms_name, ms in sorted(matches.items(), key=lambda x: x[1]["size"], reverse=True):
+        types = ", ".join(f"{_type}x{count}" for _type, count in sorted(ms["types"].items()))
+        print(f"{ms_name} size={ms['size']} max_frequency={max(ms['frequencies'].values())} types=[{types}]")
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,8 @@ from matplotlib import cm
 import matplotlib.patches as mpatches
 from typing import Iterable, Type, Union, Set, Optional, Tuple, Dict, Hashable, List
 import json
+import random
+import numpy as np
 from hashlib import sha256
 
 
@@ -17,6 +19,30 @@ def type_hash(_type: str, parent_types: Iterable[str]) -> str:
 def combine_hashes(*hashes: str) -> str:
     return string_hash(sorted(hashes))
 
+def seed_random(*key: Hashable) -> None:
+    """Seeds random and np.random from a hash of key"""
+    seed = int(string_hash(key), 16) % 2**32
+    random.seed(seed)
+    np.random.seed(seed)
+
+def job_type_id(trace_name: str, job_name: str, index: int) -> Tuple[str, str]:
+    """Type and id of the index-th job of a workflowhub trace"""
+    #specific for epigenomics -- have to think about how to do it in general
+    if "genome-dax" in trace_name:
+        _type, *_ = job_name.split('_')
+        return _type, str(index)
+    try:
+        _type, _id = job_name.split('_ID')
+    except ValueError:
+        _type, _id = job_name.split('_0')
+    return _type, _id
+
+def iter_jobs(content: Dict) -> Iterable[Tuple[str, str, str, List[str]]]:
+    """Yields (name, type, id, parents) for every job of a workflowhub trace"""
+    for i, job in enumerate(content['workflow']['jobs']):
+        _type, _id = job_type_id(content['name'], job['name'], i)
+        yield job['name'], _type, _id, job['parents']
+
 def create_graph(path: Union[str, pathlib.Path]) -> nx.DiGraph:
     path = pathlib.Path(path)
     with path.open() as fp:
@@ -28,26 +54,10 @@ def create_graph(path: Union[str, pathlib.Path]) -> nx.DiGraph:
         graph.add_node("SRC", label="SRC", type="SRC", id="SRC")
         graph.add_node("DST", label="DST", type="DST", id="DST")
 
-        id_count = 0
-
-        for job in content['workflow']['jobs']:
-
-            #specific for epigenomics -- have to think about how to do it in general
-            if "genome-dax" in content['name']:
-                _type, *_ = job['name'].split('_')
-                graph.add_node(job['name'], label=_type, type=_type, id=str(id_count))
-                id_count += 1
-            else:
-                try:
-                    _type, _id = job['name'].split('_ID')
-                except ValueError:
-                    _type, _id = job['name'].split('_0')
-                graph.add_node(job['name'], label=_type, type=_type, id=_id)
-
-    
-        # for job in content['workflow']['jobs']:
-            for parent in job['parents']:
-                graph.add_edge(parent, job['name'])
+        for name, _type, _id, parents in iter_jobs(content):
+            graph.add_node(name, label=_type, type=_type, id=_id)
+            for parent in parents:
+                graph.add_edge(parent, name)
 
         for node in graph.nodes:
             